@@ -23,6 +23,7 @@ QUEUE_ARN=$(
 aws lambda create-event-source-mapping \
     --function-name $LAMBDA_FUNCTION_NAME \
     --batch-size 10 \
+    --function-response-types ReportBatchItemFailures \
     --event-source-arn $QUEUE_ARN \
     --region $REGION --profile $PROFILE
 
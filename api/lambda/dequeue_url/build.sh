@@ -3,6 +3,9 @@
 # Variables
 BUCKET_NAME="chat-bro-userdata"
 TABLE_NAME="PdfMetadataTable"
+CONTENT_INDEX_TABLE_NAME="PdfContentIndexTable"
+NEGATIVE_CACHE_TABLE_NAME="PdfNegativeCacheTable"
+FETCH_LEASE_TABLE_NAME="PdfFetchLeaseTable"
 QUEUE_NAME="MyReceiveURLQueue"
 LAMBDA_FUNCTION_NAME="dequeue_url"
 ROLE_NAME="LambdaS3DynamoDBRole"
@@ -54,6 +57,66 @@ else
     echo "DynamoDB table '$TABLE_NAME' created."
 fi
 
+# Step 2b: Check if the content-hash index table exists, create if it does not
+if aws dynamodb describe-table --table-name $CONTENT_INDEX_TABLE_NAME --region $REGION --profile $PROFILE 2>/dev/null; then
+    echo "DynamoDB table '$CONTENT_INDEX_TABLE_NAME' already exists."
+else
+    aws dynamodb create-table \
+        --table-name $CONTENT_INDEX_TABLE_NAME \
+        --attribute-definitions \
+            AttributeName=content_sha256,AttributeType=S \
+        --key-schema \
+            AttributeName=content_sha256,KeyType=HASH \
+        --billing-mode PAY_PER_REQUEST \
+        --region $REGION \
+        --profile $PROFILE
+    echo "DynamoDB table '$CONTENT_INDEX_TABLE_NAME' created."
+fi
+
+# Step 2c: Check if the negative cache table exists, create it with a TTL on expires_at if it does not
+if aws dynamodb describe-table --table-name $NEGATIVE_CACHE_TABLE_NAME --region $REGION --profile $PROFILE 2>/dev/null; then
+    echo "DynamoDB table '$NEGATIVE_CACHE_TABLE_NAME' already exists."
+else
+    aws dynamodb create-table \
+        --table-name $NEGATIVE_CACHE_TABLE_NAME \
+        --attribute-definitions \
+            AttributeName=url,AttributeType=S \
+        --key-schema \
+            AttributeName=url,KeyType=HASH \
+        --billing-mode PAY_PER_REQUEST \
+        --region $REGION \
+        --profile $PROFILE
+    aws dynamodb wait table-exists --table-name $NEGATIVE_CACHE_TABLE_NAME --region $REGION --profile $PROFILE
+    aws dynamodb update-time-to-live \
+        --table-name $NEGATIVE_CACHE_TABLE_NAME \
+        --time-to-live-specification Enabled=true,AttributeName=expires_at \
+        --region $REGION \
+        --profile $PROFILE
+    echo "DynamoDB table '$NEGATIVE_CACHE_TABLE_NAME' created."
+fi
+
+# Step 2d: Check if the fetch lease table exists, create it with a TTL on expires_at if it does not
+if aws dynamodb describe-table --table-name $FETCH_LEASE_TABLE_NAME --region $REGION --profile $PROFILE 2>/dev/null; then
+    echo "DynamoDB table '$FETCH_LEASE_TABLE_NAME' already exists."
+else
+    aws dynamodb create-table \
+        --table-name $FETCH_LEASE_TABLE_NAME \
+        --attribute-definitions \
+            AttributeName=url,AttributeType=S \
+        --key-schema \
+            AttributeName=url,KeyType=HASH \
+        --billing-mode PAY_PER_REQUEST \
+        --region $REGION \
+        --profile $PROFILE
+    aws dynamodb wait table-exists --table-name $FETCH_LEASE_TABLE_NAME --region $REGION --profile $PROFILE
+    aws dynamodb update-time-to-live \
+        --table-name $FETCH_LEASE_TABLE_NAME \
+        --time-to-live-specification Enabled=true,AttributeName=expires_at \
+        --region $REGION \
+        --profile $PROFILE
+    echo "DynamoDB table '$FETCH_LEASE_TABLE_NAME' created."
+fi
+
 # Step 3: Check if IAM role exists, create if it does not
 # if aws iam get-role --role-name $ROLE_NAME --region $REGION --profile $PROFILE 2>/dev/null; then
 #     echo "IAM role '$ROLE_NAME' already exists."
@@ -145,7 +208,7 @@ if [ "$LAMBDA_MOD_TIME" -gt "$ZIP_MOD_TIME" ]; then
     # Create a deployment package
     rm -rf package
     mkdir package
-    cp $LAMBDA_FUNCTION_FILE package/
+    cp $LAMBDA_FUNCTION_FILE pdf_downloader.py content_index.py spill_buffer.py host_limiter.py negative_cache.py fetch_leases.py document_state.py package/
     cd package
     zip -r ../$ZIP_FILE .
     cd ..
@@ -238,11 +301,18 @@ if [ -z "$MAPPING_UUID" ]; then
     aws lambda create-event-source-mapping \
         --function-name $LAMBDA_FUNCTION_NAME \
         --batch-size 10 \
+        --function-response-types ReportBatchItemFailures \
         --event-source-arn $QUEUE_ARN \
         --region $REGION \
         --profile $PROFILE
     echo "SQS trigger added to Lambda function '$LAMBDA_FUNCTION_NAME'."
 else
+    # The handler reports failed records individually, so only those are redelivered
+    aws lambda update-event-source-mapping \
+        --uuid $MAPPING_UUID \
+        --function-response-types ReportBatchItemFailures \
+        --region $REGION \
+        --profile $PROFILE
     echo "SQS trigger already exists for Lambda function '$LAMBDA_FUNCTION_NAME'."
 fi
 
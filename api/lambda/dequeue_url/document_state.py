@@ -0,0 +1,174 @@
+# document_state.py
+import logging
+import time
+from botocore.exceptions import ClientError
+
+# Configure logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+QUEUED = 'Queued'
+DOWNLOADING = 'Downloading'
+DOWNLOADED = 'Downloaded'
+RENDERING = 'Rendering'
+RENDERED = 'Rendered'
+EXTRACTING = 'Extracting'
+DONE = 'Done'
+FAILED = 'Failed'
+
+# The order documents move through; a document has completed every stage before its status
+STAGES = (QUEUED, DOWNLOADING, DOWNLOADED, RENDERING, RENDERED, EXTRACTING, DONE)
+
+# States that claim a document for one worker until they complete or go stale
+IN_PROGRESS = (DOWNLOADING, RENDERING, EXTRACTING)
+
+# The states each state can be entered from. A document without a status is Queued.
+# Known URLs may be downloaded again: the fetch is conditional, so an unchanged PDF costs one request.
+TRANSITIONS = {
+    DOWNLOADING: (QUEUED, DOWNLOADED, RENDERED, DONE, FAILED),
+    DOWNLOADED: (DOWNLOADING,),
+    RENDERING: (DOWNLOADED,),
+    # An unchanged re-download returns a rendered document to where it was
+    RENDERED: (RENDERING, DOWNLOADING),
+    EXTRACTING: (RENDERED,),
+    # Duplicate and unchanged content finishes straight from Downloading
+    DONE: (DOWNLOADING, RENDERED, EXTRACTING),
+    FAILED: IN_PROGRESS
+}
+
+
+class StateConflict(Exception):
+    """Raised when a document is not in a state the requested transition can start from."""
+
+    def __init__(self, url, state):
+        super().__init__(f"Document {url} cannot move to {state} from its current state")
+        self.url = url
+        self.state = state
+
+
+def has_completed(item, state):
+    """True if the document's status is `state` or a later stage."""
+    status = item.get('status', {}).get('S', QUEUED)
+    return status in STAGES and STAGES.index(status) >= STAGES.index(state)
+
+
+class DocumentStates:
+    """
+    Per-document state machine stored in the metadata table's `status` attribute.
+
+    Every transition is a conditional UpdateItem that checks the current status
+    against TRANSITIONS and increments a `version` counter. A transition can also
+    require the version the caller last saw, so a worker that was overtaken (by a
+    redelivery, or another message for the same URL) fails instead of moving the
+    document backwards. In-progress states record the SQS message working on the
+    document (`message_id`) and when they were entered; the same message may
+    re-enter its own state, and anyone may take over one older than
+    `stale_seconds`, so a crashed worker does not block a document forever.
+    Items written before the state machine existed have no version and may always
+    be downloaded again.
+
+    Transitions are sent one UpdateItem at a time, as they happen. BatchWriteItem
+    cannot carry a condition, and the caller needs each transition's outcome before
+    it acknowledges its message, so there is nothing left to buffer.
+    """
+
+    def __init__(self, dynamodb_client, table_name, stale_seconds=3600):
+        self.dynamodb = dynamodb_client
+        self.table_name = table_name
+        self.stale_seconds = stale_seconds
+
+    def get(self, url):
+        """Returns the document's item, or an empty dict if it has none yet."""
+        response = self.dynamodb.get_item(
+            TableName=self.table_name,
+            Key={'url': {'S': url}},
+            ConsistentRead=True
+        )
+        return response.get('Item', {})
+
+    def advance(self, url, state, version=None, message_id=None, attributes=None, remove=()):
+        """
+        Moves the document to `state`, setting `attributes` (name -> DynamoDB value) and
+        removing the `remove` attributes in the same write.
+
+        Args:
+        - version (int): If given, the move only happens if the document is still at this version.
+        - message_id (str): The SQS message doing the work, recorded for in-progress states.
+
+        Returns:
+        - The document's new version.
+
+        Raises StateConflict if the document's state or version does not allow the move.
+        """
+        now = int(time.time())
+        names = {'#status': 'status', '#version': 'version'}
+        values = {
+            ':state': {'S': state},
+            ':now': {'N': str(now)},
+            ':one': {'N': '1'},
+            ':zero': {'N': '0'}
+        }
+        updates = [
+            '#status = :state',
+            '#version = if_not_exists(#version, :zero) + :one',
+            'status_updated_at = :now'
+        ]
+
+        from_states = TRANSITIONS[state]
+        for i, from_state in enumerate(from_states):
+            values[f':from{i}'] = {'S': from_state}
+        allowed = [f"#status IN ({', '.join(f':from{i}' for i in range(len(from_states)))})"]
+        if QUEUED in from_states:
+            allowed.append('attribute_not_exists(#status)')
+        if state == DOWNLOADING:
+            allowed.append('attribute_not_exists(#version)')
+        if state in IN_PROGRESS:
+            for i, in_progress in enumerate(IN_PROGRESS):
+                values[f':active{i}'] = {'S': in_progress}
+            values[':stale_before'] = {'N': str(now - self.stale_seconds)}
+            allowed.append(f"(#status IN ({', '.join(f':active{i}' for i in range(len(IN_PROGRESS)))}) "
+                           "AND status_updated_at < :stale_before)")
+            if message_id is not None:
+                values[':message_id'] = {'S': message_id}
+                updates.append('message_id = :message_id')
+                allowed.append('(#status = :state AND message_id = :message_id)')
+
+        condition = ' OR '.join(allowed)
+        if version is not None:
+            values[':version'] = {'N': str(version)}
+            condition = f"({condition}) AND #version = :version"
+
+        for i, (name, value) in enumerate((attributes or {}).items()):
+            names[f'#attr{i}'] = name
+            values[f':attr{i}'] = value
+            updates.append(f'#attr{i} = :attr{i}')
+        expression = 'SET ' + ', '.join(updates)
+        if remove:
+            expression += ' REMOVE ' + ', '.join(remove)
+
+        try:
+            response = self.dynamodb.update_item(
+                TableName=self.table_name,
+                Key={'url': {'S': url}},
+                UpdateExpression=expression,
+                ConditionExpression=condition,
+                ExpressionAttributeNames=names,
+                ExpressionAttributeValues=values,
+                ReturnValues='UPDATED_NEW'
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+            raise StateConflict(url, state) from e
+
+        new_version = int(response['Attributes']['version']['N'])
+        logger.info(f"Document {url} is now {state} (version {new_version})")
+        return new_version
+
+    def fail(self, url, version, reason):
+        """Marks an in-progress document as Failed, unless another worker has moved it on."""
+        try:
+            return self.advance(url, FAILED, version, attributes={'failure_reason': {'S': reason}})
+        except StateConflict:
+            logger.info(f"Document {url} moved on before it could be marked failed")
+            return None
@@ -1,9 +1,16 @@
 import os
-import json
 import boto3
 import logging
 import re
-from pdf_downloader import clean_url, download_pdf
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from botocore.config import Config
+from contextlib import nullcontext
+from host_limiter import HostUnavailable
+from pdf_downloader import clean_url, transfer_pdf_to_s3
+from content_index import ContentIndex
+from negative_cache import NegativeCache
+from fetch_leases import FetchLeases
+from document_state import DocumentStates, StateConflict, has_completed, DOWNLOADING, DOWNLOADED, RENDERED, DONE
 from urllib.parse import urlparse, unquote
 from datetime import datetime
 
@@ -11,71 +18,239 @@ from datetime import datetime
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-s3 = boto3.client('s3')
-sqs = boto3.client('sqs')
-dynamodb = boto3.client('dynamodb')
+# Number of records from one SQS batch processed at once
+record_concurrency = int(os.getenv('RECORD_CONCURRENCY', 10))
+
+# Size the connection pools so concurrent records don't queue on the default of 10
+client_config = Config(max_pool_connections=max(10, record_concurrency * 4))
+s3 = boto3.client('s3', config=client_config)
+sqs = boto3.client('sqs', config=client_config)
+dynamodb = boto3.client('dynamodb', config=client_config)
 bucket_name = os.environ['BUCKET_NAME']
 queue_url = os.environ['QUEUE_URL']
 dynamodb_table = os.environ['DYNAMODB_TABLE']
 
-def lambda_handler(event, context):
+# Documents move through the states in document_state.py, so redelivered records skip the stages already done;
+# an in-progress state left for DOCUMENT_STALE_SECONDS can be taken over
+documents = DocumentStates(dynamodb, dynamodb_table, int(os.getenv('DOCUMENT_STALE_SECONDS', 3600)))
+
+# Optional SHA-256 -> S3 key index used to store each distinct PDF only once
+content_index_table = os.getenv('CONTENT_INDEX_TABLE')
+content_index = ContentIndex(dynamodb, content_index_table) if content_index_table else None
+
+# Optional cache of URLs that failed permanently (404, not a PDF, ...), which are then dropped without a fetch
+negative_cache_table = os.getenv('NEGATIVE_CACHE_TABLE')
+negative_cache = NegativeCache(
+    dynamodb, negative_cache_table,
+    int(os.getenv('NEGATIVE_CACHE_TTL_SECONDS', 7 * 24 * 3600)),
+    int(os.getenv('NEGATIVE_CACHE_LOCAL_SIZE', 10000))
+) if negative_cache_table else None
+
+# Optional single-flight leases so concurrent messages for the same URL fetch it only once
+fetch_lease_table = os.getenv('FETCH_LEASE_TABLE')
+fetch_leases = FetchLeases(
+    dynamodb, fetch_lease_table, int(os.getenv('FETCH_LEASE_SECONDS', 900))
+) if fetch_lease_table else None
+
+def rendered_state(item):
+    """The state an unchanged document goes back to: Done or Rendered, or None if its pages were never rendered."""
+    if item.get('status', {}).get('S') == DONE:
+        return DONE
+    return RENDERED if has_completed(item, RENDERED) else None
+
+def cached_validators(item):
+    """
+    Returns the ETag/Last-Modified recorded the last time the document's URL was downloaded.
+
+    Documents whose pages were never rendered are fetched unconditionally, since a 304
+    would leave them with nothing to render.
+    """
+    if rendered_state(item) is None:
+        return {}
+    return {name: item[name]['S'] for name in ('etag', 'last_modified') if name in item}
+
+def validator_attributes(validators):
+    """The origin's validators as item attributes, so the next fetch of the URL can be conditional."""
+    attributes = {}
+    if validators.get('etag'):
+        attributes['etag'] = {'S': validators['etag']}
+    if validators.get('last_modified'):
+        attributes['last_modified'] = {'S': validators['last_modified']}
+    if validators.get('content_length'):
+        attributes['content_length'] = {'N': validators['content_length']}
+    return attributes
+
+def item_version(item):
+    return int(item['version']['N']) if 'version' in item else None
+
+def save_download_metadata(cleaned_url, object_name, result, version):
+    """
+    Records a finished download and moves the document on from Downloading.
+
+    Content already stored for another URL was rendered there, so the document is
+    Done; otherwise it is Downloaded and its S3 event starts the rendering.
+    """
+    # Point at the existing object when the same bytes were already stored
+    stored_key = result['s3_key']
+    duplicate = stored_key != object_name
+
+    # Construct S3 URI
+    s3_uri = f"s3://{bucket_name}/{stored_key}"
+
+    # Save metadata to DynamoDB
+    current_time = datetime.utcnow().isoformat()
+    # The downloader counted the bytes while storing them
+    file_size = result['file_size']
+
+    attributes = {
+        's3_uri': {'S': s3_uri},
+        'duplicate': {'BOOL': duplicate},
+        'downloaded_timestamp': {'S': current_time},
+        'file_size': {'N': str(file_size)},
+        'content_sha256': {'S': result['content_sha256']},
+        **validator_attributes(result['validators'])
+    }
+
+    # Wait for the write so the message is only acked once its metadata is stored
+    documents.advance(cleaned_url, DONE if duplicate else DOWNLOADED, version, attributes=attributes)
+    logger.info(f"Metadata saved to DynamoDB for URL: {cleaned_url}")
+
+def process_record(record):
+    """
+    Downloads the PDF referenced by one SQS record, stores it in S3 and records its metadata.
+
+    Returns:
+    - True if the record is done with and can be removed from the queue, False if it
+      should be redelivered.
+    """
+    message_body = record['body']
+    logger.info(f"Processing message: {message_body}")
+
+    cleaned_url = clean_url(message_body)
+    if not re.match(r'^https?://.*\.pdf$', cleaned_url, re.IGNORECASE):
+        # Retrying will not turn this into a PDF URL
+        logger.warning(f"Message is not a PDF URL: {message_body}")
+        return True
+
     try:
-        for record in event['Records']:
-            message_body = record['body']
-            logger.info(f"Processing message: {message_body}")
-
-            cleaned_url = clean_url(message_body)
-            if re.match(r'^https?://.*\.pdf$', cleaned_url, re.IGNORECASE):
-                try:
-                    pdf_data = download_pdf(cleaned_url)
-                    if pdf_data:
-                        parsed_url = urlparse(cleaned_url)
-                        hostname = parsed_url.netloc.replace('.', '_')
-                        base_name = os.path.basename(unquote(parsed_url.path)).replace('.pdf', '')
-                        object_name = f"{hostname}/{base_name}/{base_name}.pdf"
-                        
-                        # Upload PDF to S3
-                        s3.upload_fileobj(pdf_data, bucket_name, object_name)
-                        logger.info(f"PDF saved to S3: s3://{bucket_name}/{object_name}")
-                        
-                        # Construct S3 URI
-                        s3_uri = f"s3://{bucket_name}/{object_name}"
-                        
-                        # Save metadata to DynamoDB
-                        current_time = datetime.utcnow().isoformat()
-                        response = s3.head_object(Bucket=bucket_name, Key=object_name)
-                        file_size = response['ContentLength']
-                        
-                        dynamodb.put_item(
-                            TableName=dynamodb_table,
-                            Item={
-                                'url': {'S': cleaned_url},
-                                's3_uri': {'S': s3_uri},
-                                'status': {'S': 'Downloaded'},
-                                'downloaded_timestamp': {'S': current_time},
-                                'file_size': {'N': str(file_size)}
-                            }
-                        )
-                        logger.info(f"Metadata saved to DynamoDB for URL: {cleaned_url}")
-
-                        # Remove the message from the queue
-                        receipt_handle = record['receiptHandle']
-                        sqs.delete_message(
-                            QueueUrl=queue_url,
-                            ReceiptHandle=receipt_handle
-                        )
-                        logger.info(f"Message removed from the queue: {message_body}")
-                    else:
-                        logger.error(f"Failed to download or validate the PDF: {cleaned_url}")
-                except Exception as e:
-                    logger.error(f"Error processing PDF URL {cleaned_url}: {e}")
+        # Retrying will not fix a URL that already failed permanently
+        failure_class = negative_cache.lookup(cleaned_url) if negative_cache else None
+        if failure_class:
+            logger.info(f"Skipping URL that failed permanently ({failure_class}): {cleaned_url}")
+            return True
+
+        lease = fetch_leases.hold(cleaned_url, record['messageId']) if fetch_leases else nullcontext(True)
+        with lease as acquired:
+            if not acquired:
+                # The worker holding the lease keeps its own message until the fetch succeeds
+                logger.info(f"URL is already being fetched by another worker, skipping: {cleaned_url}")
+                return True
+
+            parsed_url = urlparse(cleaned_url)
+            hostname = parsed_url.netloc.replace('.', '_')
+            base_name = os.path.basename(unquote(parsed_url.path)).replace('.pdf', '')
+            object_name = f"{hostname}/{base_name}/{base_name}.pdf"
+
+            item = documents.get(cleaned_url)
+            if item.get('message_id', {}).get('S') == record['messageId'] and has_completed(item, DOWNLOADED):
+                # An earlier delivery of this record already stored the PDF
+                logger.info(f"Download of {cleaned_url} already completed, skipping it")
+                return True
+
+            try:
+                version = documents.advance(cleaned_url, DOWNLOADING, item_version(item), record['messageId'])
+            except StateConflict:
+                logger.info(f"Document is being processed by another worker, skipping: {cleaned_url}")
+                return True
+
+            # Download the PDF and upload it to S3, unless it is unchanged since the last fetch
+            result = transfer_pdf_to_s3(
+                cleaned_url, s3, bucket_name, object_name, content_index, cached_validators(item), negative_cache,
+                item.get('content_sha256', {}).get('S')
+            )
+            if result is None:
+                logger.error(f"Failed to download or validate the PDF: {cleaned_url}")
+                # Only failures that may be transient are worth a redelivery
+                failure_class = negative_cache.lookup(cleaned_url, local_only=True) if negative_cache else None
+                if failure_class:
+                    documents.fail(cleaned_url, version, failure_class)
+                return bool(failure_class)
+
+            # A 304, or bytes the content index already has under this URL's own key, upload nothing
+            if result['not_modified'] or result['duplicate'] and result['s3_key'] == object_name:
+                state = rendered_state(item)
+                if state is not None:
+                    logger.info(f"PDF unchanged since last download, skipping: {cleaned_url}")
+                    # Unchanged content keeps the pages already rendered from it
+                    documents.advance(cleaned_url, state, version, attributes=validator_attributes(result['validators']))
+                else:
+                    # No upload means no S3 event to render the pages; drop the index entry so a
+                    # resubmission stores the PDF again
+                    logger.warning(f"PDF unchanged but never rendered, failing it: {cleaned_url}")
+                    if result['duplicate']:
+                        content_index.release(result['content_sha256'], object_name)
+                    documents.fail(cleaned_url, version, 'not_rendered')
             else:
-                logger.warning(f"Message is not a PDF URL: {message_body}")
+                logger.info(f"PDF saved to S3: s3://{bucket_name}/{result['s3_key']}")
+                save_download_metadata(cleaned_url, object_name, result, version)
+            return True
+    except HostUnavailable as e:
+        # Keep the message hidden until the host's circuit closes again
+        logger.warning(f"Parking {cleaned_url}: {e}")
+        park_message(record['receiptHandle'], e.retry_after)
+        return False
+    except Exception as e:
+        logger.error(f"Error processing PDF URL {cleaned_url}: {e}", exc_info=True)
+        return False
 
+def park_message(receipt_handle, delay):
+    """Hides a message for `delay` seconds (at most the SQS limit of 12 hours) before it is redelivered."""
+    try:
+        sqs.change_message_visibility(
+            QueueUrl=queue_url,
+            ReceiptHandle=receipt_handle,
+            VisibilityTimeout=min(int(delay) + 1, 12 * 3600)
+        )
     except Exception as e:
-        logger.error(f"Error processing message: {e}", exc_info=True)
+        logger.error(f"Error parking message: {e}", exc_info=True)
 
-    return {
-        'statusCode': 200,
-        'body': json.dumps('Processing Complete')
-    }
+def delete_messages(records):
+    """Removes processed records from the queue, up to 10 per DeleteMessageBatch call."""
+    for start in range(0, len(records), 10):
+        entries = [
+            {'Id': record['messageId'], 'ReceiptHandle': record['receiptHandle']}
+            for record in records[start:start + 10]
+        ]
+        try:
+            response = sqs.delete_message_batch(QueueUrl=queue_url, Entries=entries)
+            for failure in response.get('Failed', []):
+                logger.error(f"Failed to remove message {failure['Id']} from the queue: {failure.get('Message')}")
+        except Exception as e:
+            logger.error(f"Error removing messages from the queue: {e}", exc_info=True)
+
+def lambda_handler(event, context):
+    """
+    Processes the records of an SQS batch concurrently.
+
+    Finished records are removed from the queue in batches of 10 as they complete,
+    so they are not redone if the invocation later times out. Records that failed
+    are returned in batchItemFailures so only they are redelivered (the event
+    source mapping must have ReportBatchItemFailures enabled).
+    """
+    batch_item_failures = []
+    processed = []
+    with ThreadPoolExecutor(max_workers=record_concurrency) as executor:
+        futures = {executor.submit(process_record, record): record for record in event['Records']}
+        for future in as_completed(futures):
+            record = futures[future]
+            if future.result():
+                processed.append(record)
+                if len(processed) == 10:
+                    delete_messages(processed)
+                    processed = []
+            else:
+                batch_item_failures.append({'itemIdentifier': record['messageId']})
+
+    delete_messages(processed)
+    logger.info(f"Processed {len(event['Records'])} messages, {len(batch_item_failures)} failed")
+    return {'batchItemFailures': batch_item_failures}
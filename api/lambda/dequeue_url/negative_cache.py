@@ -0,0 +1,84 @@
+# negative_cache.py
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+# Configure logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Origin responses that will not change on retry
+PERMANENT_FAILURE_STATUSES = (401, 403, 404, 410)
+
+
+class NegativeCache:
+    """
+    Remembers cleaned URLs whose fetch failed permanently, so they are not fetched again.
+
+    Entries live in a DynamoDB table keyed on `url` (S) with a TTL on `expires_at`,
+    and record the failure class (e.g. 'http_404' or 'not_pdf'). Hits are also kept
+    in an in-process LRU of `local_size` entries, so repeat lookups of a failing URL
+    cost no DynamoDB call. Misses are not cached locally.
+    """
+
+    def __init__(self, dynamodb_client, table_name, ttl_seconds, local_size=10000):
+        self.dynamodb = dynamodb_client
+        self.table_name = table_name
+        self.ttl_seconds = ttl_seconds
+        self.local_size = local_size
+        self._local = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _remember(self, cleaned_url, failure_class, expires_at):
+        with self._lock:
+            self._local[cleaned_url] = (failure_class, expires_at)
+            self._local.move_to_end(cleaned_url)
+            while len(self._local) > self.local_size:
+                self._local.popitem(last=False)
+
+    def _lookup_local(self, cleaned_url):
+        with self._lock:
+            entry = self._local.get(cleaned_url)
+            if entry is None:
+                return None
+            if entry[1] <= time.time():
+                del self._local[cleaned_url]
+                return None
+            self._local.move_to_end(cleaned_url)
+            return entry[0]
+
+    def lookup(self, cleaned_url, local_only=False):
+        """Returns the failure class recorded for the URL, or None if it is not known to fail."""
+        failure_class = self._lookup_local(cleaned_url)
+        if failure_class is not None or local_only:
+            return failure_class
+
+        response = self.dynamodb.get_item(
+            TableName=self.table_name,
+            Key={'url': {'S': cleaned_url}}
+        )
+        item = response.get('Item')
+        # TTL deletion lags expiry, so skip expired items that are still in the table
+        if not item or int(item['expires_at']['N']) <= time.time():
+            return None
+        self._remember(cleaned_url, item['failure_class']['S'], int(item['expires_at']['N']))
+        return item['failure_class']['S']
+
+    def record(self, cleaned_url, failure_class):
+        expires_at = int(time.time()) + self.ttl_seconds
+        self._remember(cleaned_url, failure_class, expires_at)
+        try:
+            self.dynamodb.put_item(
+                TableName=self.table_name,
+                Item={
+                    'url': {'S': cleaned_url},
+                    'failure_class': {'S': failure_class},
+                    'failed_timestamp': {'S': datetime.utcnow().isoformat()},
+                    'expires_at': {'N': str(expires_at)}
+                }
+            )
+            logger.info(f"Recorded permanent failure of {cleaned_url}: {failure_class}")
+        except Exception as e:
+            logger.error(f"Failed to record permanent failure of {cleaned_url}: {e}")
@@ -1,16 +1,43 @@
 # pdf_downloader.py
+import hashlib
+import os
 import re
+import threading
 import requests
 import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from requests.adapters import HTTPAdapter
 from requests.packages.urllib3.util.retry import Retry
-from io import BytesIO
+from spill_buffer import SpillBuffer
+from host_limiter import HostLimiter
+from negative_cache import PERMANENT_FAILURE_STATUSES
 from urllib.parse import urlparse, urlunparse
 
 # Configure logging
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+# Multipart upload tuning (S3 requires every part except the last to be >= 5 MB)
+PART_SIZE = max(int(os.getenv('S3_PART_SIZE', 8 * 1024 * 1024)), 5 * 1024 * 1024)
+MAX_BUFFERED_PARTS = max(int(os.getenv('S3_MAX_BUFFERED_PARTS', 4)), 2)
+CHUNK_SIZE = 64 * 1024
+
+# In-memory downloads spill to a temp file beyond this size
+DOWNLOAD_BUFFER_MAX_MEMORY = int(os.getenv('DOWNLOAD_BUFFER_MAX_MEMORY', 64 * 1024 * 1024))
+
+# Large files from origins that accept byte ranges are fetched over several connections
+RANGED_DOWNLOAD_MIN_SIZE = int(os.getenv('RANGED_DOWNLOAD_MIN_SIZE', 64 * 1024 * 1024))
+RANGED_DOWNLOAD_CONNECTIONS = int(os.getenv('RANGED_DOWNLOAD_CONNECTIONS', 4))
+
+# 'stream' pipes the download straight into a multipart upload, 'buffer' downloads fully first
+TRANSFER_MODE = os.getenv('TRANSFER_MODE', 'stream')
+
+# Returned in place of the PDF when a conditional request gets a 304
+NOT_MODIFIED = object()
+
+HEADERS = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3'}
+
 # Setup requests session with retries
 session = requests.Session()
 retry = Retry(
@@ -22,39 +49,427 @@ adapter = HTTPAdapter(max_retries=retry)
 session.mount('http://', adapter)
 session.mount('https://', adapter)
 
+# Per-host rate limits and circuit breakers, shared by all threads in the process
+host_limiter = HostLimiter.from_env(os.environ)
+
+class RangeNotHonoured(requests.exceptions.RequestException):
+    """The origin answered a range request with something other than the range asked for."""
+
+def _get(url, headers, stream=False, rate_limited=True):
+    """
+    Sends a GET through the host's rate limit and records the outcome with its circuit breaker.
+
+    A 429, a 5xx or exhausted 5xx retries count as failures. Raises HostUnavailable
+    without sending anything while the host's circuit is open. `rate_limited=False`
+    skips the rate limit for follow-up requests of a download that already took its token.
+    """
+    host = urlparse(url).netloc
+    host_limiter.acquire(host, rate_limited)
+    try:
+        response = session.get(url, headers=headers, stream=stream)
+    except requests.exceptions.RetryError:
+        host_limiter.record(host, ok=False)
+        raise
+    host_limiter.record(host, ok=response.status_code != 429 and response.status_code < 500)
+    return response
+
 def is_valid_pdf(content):
     return content.startswith(b'%PDF')
 
+def _record_permanent_failure(negative_cache, cleaned_url, failure_class):
+    if negative_cache is not None:
+        negative_cache.record(cleaned_url, failure_class)
+
+def _check_response(response, cleaned_url, negative_cache):
+    """Raises for error responses, first recording those that will not change on retry."""
+    if response.status_code in PERMANENT_FAILURE_STATUSES:
+        _record_permanent_failure(negative_cache, cleaned_url, f"http_{response.status_code}")
+    response.raise_for_status()
+
 def clean_url(pdf_url):
     parsed_url = urlparse(pdf_url)
     cleaned_url = urlunparse(parsed_url._replace(query='', fragment=''))
     return cleaned_url
 
-def download_pdf(cleaned_url):
+def request_headers(validators=None):
+    """Builds the request headers, turning cached validators into a conditional request."""
+    headers = dict(HEADERS)
+    if validators:
+        if validators.get('etag'):
+            headers['If-None-Match'] = validators['etag']
+        if validators.get('last_modified'):
+            headers['If-Modified-Since'] = validators['last_modified']
+    return headers
+
+def response_validators(response):
+    """Returns the origin's cache validators so a later fetch can be made conditional."""
+    return {
+        'etag': response.headers.get('ETag'),
+        'last_modified': response.headers.get('Last-Modified'),
+        'content_length': response.headers.get('Content-Length')
+    }
+
+def _ranged_download_size(response):
+    """Returns the body size if it should be fetched as parallel ranges, otherwise None."""
+    if RANGED_DOWNLOAD_CONNECTIONS < 2:
+        return None
+    if response.headers.get('Accept-Ranges', '').lower() != 'bytes':
+        return None
+    if response.headers.get('Content-Encoding', 'identity').lower() != 'identity':
+        return None
+    content_length = response.headers.get('Content-Length', '')
+    if not content_length.isdigit() or int(content_length) < RANGED_DOWNLOAD_MIN_SIZE:
+        return None
+    return int(content_length)
+
+def _fetch_range(cleaned_url, start, end, if_range):
+    headers = dict(HEADERS)
+    headers['Range'] = f"bytes={start}-{end}"
+    if if_range:
+        headers['If-Range'] = if_range
+    # The download's first request took the host's token; its ranges are not charged again
+    with _get(cleaned_url, headers, stream=True, rate_limited=False) as response:
+        response.raise_for_status()
+        # Check before reading: an origin that ignores Range, or a failed If-Range, sends the whole file
+        content_range = response.headers.get('Content-Range', '')
+        if response.status_code != 206 or not content_range.startswith(f"bytes {start}-{end}/"):
+            raise RangeNotHonoured(f"Origin did not honour range {start}-{end}")
+        content = b''.join(response.iter_content(chunk_size=CHUNK_SIZE))
+    if len(content) != end - start + 1:
+        raise RangeNotHonoured(f"Origin sent {len(content)} bytes for range {start}-{end}")
+    return content
+
+def _iter_ranges(cleaned_url, total_size, if_range):
+    """
+    Fetches a body as PART_SIZE byte ranges over several connections and yields them in order.
+
+    Ranges are aligned with multipart upload parts, and at most RANGED_DOWNLOAD_CONNECTIONS
+    of them are downloaded or waiting to be consumed at any time.
+    """
+    ranges = [(start, min(start + PART_SIZE, total_size) - 1) for start in range(0, total_size, PART_SIZE)]
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=RANGED_DOWNLOAD_CONNECTIONS) as executor:
+        try:
+            for start, end in ranges:
+                if len(pending) == RANGED_DOWNLOAD_CONNECTIONS:
+                    yield pending.popleft().result()
+                pending.append(executor.submit(_fetch_range, cleaned_url, start, end, if_range))
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+def iter_pdf_content(response, cleaned_url):
+    """
+    Yields the body of a PDF response.
+
+    When the origin advertises Accept-Ranges: bytes and the file is at least
+    RANGED_DOWNLOAD_MIN_SIZE, the body is fetched as parallel range requests
+    instead of over the single response stream. If the origin does not honour the
+    first ranges, the body is fetched again over a single streamed GET; once part of
+    it has been yielded, RangeNotHonoured is raised instead.
+    """
+    total_size = _ranged_download_size(response)
+    if total_size is None:
+        yield from response.iter_content(chunk_size=CHUNK_SIZE)
+        return
+
+    # If-Range makes the origin refuse the ranges if the file changes mid-download
+    etag = response.headers.get('ETag')
+    if_range = etag if etag and not etag.startswith('W/') else response.headers.get('Last-Modified')
+    response.close()
+    logger.info(f"Downloading {cleaned_url} ({total_size} bytes) over {RANGED_DOWNLOAD_CONNECTIONS} connections")
+    started = False
+    try:
+        for content in _iter_ranges(cleaned_url, total_size, if_range):
+            started = True
+            yield content
+    except RangeNotHonoured as e:
+        # Ranges of a file that changed mid-download cannot be spliced onto a new copy
+        if started:
+            raise
+        logger.warning(f"{e}, downloading {cleaned_url} over a single connection")
+        with _get(cleaned_url, HEADERS, stream=True, rate_limited=False) as response:
+            response.raise_for_status()
+            yield from response.iter_content(chunk_size=CHUNK_SIZE)
+
+def fetch_pdf(cleaned_url, validators=None, negative_cache=None):
+    """
+    Downloads a PDF into memory, sending a conditional request when validators are given.
+
+    Permanent failures (see PERMANENT_FAILURE_STATUSES, or content that is not a PDF)
+    are recorded in negative_cache when one is given.
+
+    Returns:
+    - A (pdf_data, validators) tuple. pdf_data is a SpillBuffer, NOT_MODIFIED when the origin
+      answered 304, or None if the download failed or the content is not a PDF.
+    """
     try:
         if not re.match(r'^https?://.*\.pdf$', cleaned_url, re.IGNORECASE):
             logger.info(f"Not a PDF URL: {cleaned_url}")
-            return None
-        
-        headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3'}
-        response = session.get(cleaned_url, headers=headers, stream=True)
-        response.raise_for_status()
+            return None, None
 
-        pdf_data = BytesIO()
-        for chunk in response.iter_content(chunk_size=1024):
+        response = _get(cleaned_url, request_headers(validators), stream=True)
+        if response.status_code == 304:
+            logger.info(f"PDF not modified since last fetch: {cleaned_url}")
+            return NOT_MODIFIED, validators
+        _check_response(response, cleaned_url, negative_cache)
+
+        pdf_data = SpillBuffer(DOWNLOAD_BUFFER_MAX_MEMORY)
+        for chunk in iter_pdf_content(response, cleaned_url):
             pdf_data.write(chunk)
         pdf_data.seek(0)
 
         if not is_valid_pdf(pdf_data.read(4)):
             logger.error(f"Downloaded content is not a valid PDF: {cleaned_url}")
-            return None
+            _record_permanent_failure(negative_cache, cleaned_url, 'not_pdf')
+            pdf_data.close()
+            return None, None
 
         pdf_data.seek(0)
-        return pdf_data
+        return pdf_data, response_validators(response)
 
     except requests.exceptions.RequestException as e:
         logger.error(f"Failed to download PDF: {cleaned_url}, error: {e}")
-        return None
+        return None, None
     except ValueError as e:
         logger.error(f"Invalid PDF content from URL: {cleaned_url}, error: {e}")
+        return None, None
+
+def source_metadata(cleaned_url):
+    """S3 object metadata naming the URL a PDF was downloaded from (S3 metadata must be ASCII)."""
+    return {'source-url': cleaned_url} if cleaned_url.isascii() else {}
+
+
+def download_pdf(cleaned_url):
+    pdf_data, _ = fetch_pdf(cleaned_url)
+    return pdf_data
+
+
+class MultipartUploader:
+    """
+    Writes a byte stream to S3 as a multipart upload while it is still arriving.
+
+    Full parts are handed to a small thread pool so uploading overlaps with the
+    caller producing the next part. At most `max_buffered_parts` part buffers
+    (including the one being filled) are held in memory; `write` blocks when
+    the limit is reached. Streams smaller than one part are sent with a single
+    put_object instead.
+    """
+
+    def __init__(self, s3_client, bucket, key, part_size=PART_SIZE, max_buffered_parts=MAX_BUFFERED_PARTS, metadata=None):
+        self.s3 = s3_client
+        self.bucket = bucket
+        self.key = key
+        self.metadata = metadata or {}
+        self.part_size = part_size
+        self.bytes_written = 0
+        self._buffer = bytearray()
+        self._upload_id = None
+        self._next_part_number = 1
+        self._futures = []
+        self._slots = threading.BoundedSemaphore(max_buffered_parts - 1)
+        self._executor = ThreadPoolExecutor(max_workers=max_buffered_parts - 1)
+
+    def write(self, data):
+        self._buffer += data
+        self.bytes_written += len(data)
+        while len(self._buffer) >= self.part_size:
+            part = bytes(self._buffer[:self.part_size])
+            del self._buffer[:self.part_size]
+            self._submit_part(part)
+
+    def _submit_part(self, data):
+        if self._upload_id is None:
+            response = self.s3.create_multipart_upload(Bucket=self.bucket, Key=self.key, Metadata=self.metadata)
+            self._upload_id = response['UploadId']
+
+        part_number = self._next_part_number
+        self._next_part_number += 1
+
+        self._slots.acquire()
+        future = self._executor.submit(self._upload_part, part_number, data)
+        future.add_done_callback(lambda _: self._slots.release())
+        self._futures.append(future)
+
+    def _upload_part(self, part_number, data):
+        response = self.s3.upload_part(
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=self._upload_id,
+            PartNumber=part_number,
+            Body=data
+        )
+        return {'PartNumber': part_number, 'ETag': response['ETag']}
+
+    def complete(self):
+        """Flushes the remaining buffer and finishes the upload. Returns the number of bytes written."""
+        try:
+            if self._upload_id is None:
+                self.s3.put_object(Bucket=self.bucket, Key=self.key, Body=bytes(self._buffer), Metadata=self.metadata)
+            else:
+                if self._buffer:
+                    self._submit_part(bytes(self._buffer))
+                parts = [future.result() for future in self._futures]
+                self.s3.complete_multipart_upload(
+                    Bucket=self.bucket,
+                    Key=self.key,
+                    UploadId=self._upload_id,
+                    MultipartUpload={'Parts': parts}
+                )
+            self._buffer = bytearray()
+            return self.bytes_written
+        finally:
+            self._executor.shutdown(wait=True)
+
+    def abort(self):
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        if self._upload_id is not None:
+            try:
+                self.s3.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self._upload_id)
+            except Exception as e:
+                logger.error(f"Failed to abort multipart upload for s3://{self.bucket}/{self.key}: {e}")
+        self._buffer = bytearray()
+
+
+def _store_result(key, file_size, content_sha256, validators, existing_key=None, not_modified=False):
+    return {
+        's3_key': existing_key or key,
+        'file_size': file_size,
+        'content_sha256': content_sha256,
+        'duplicate': existing_key is not None,
+        'not_modified': not_modified,
+        'validators': validators or {}
+    }
+
+
+def stream_pdf_to_s3(cleaned_url, s3_client, bucket, key, content_index=None, validators=None, negative_cache=None,
+                     previous_sha256=None):
+    """
+    Streams a PDF from a URL straight into S3 without holding the whole file in memory.
+
+    The first bytes are checked for the %PDF magic before anything is written to S3,
+    and the content is hashed as it streams. When a content_index is given, the hash
+    is claimed before the upload is completed; if the same bytes are already stored
+    the upload is aborted and the existing object is reported with duplicate=True.
+    The hash is only known once every part has been sent, so a duplicate still costs
+    the part uploads; aborting only saves the stored copy.
+    The object's `source-url` metadata records the URL it came from.
+    When validators from an earlier fetch are given the request is conditional, and a
+    304 returns without touching S3.
+
+    Args:
+    - cleaned_url (str): The cleaned URL of the PDF.
+    - s3_client: The boto3 S3 client to upload with.
+    - bucket (str): The name of the S3 bucket.
+    - key (str): The S3 key to write the PDF to.
+    - content_index (ContentIndex): Optional content-hash index used for deduplication.
+    - validators (dict): Optional etag/last_modified from the previous fetch of this URL.
+    - negative_cache (NegativeCache): Optional cache that permanent failures are recorded in.
+    - previous_sha256 (str): Hash of the content stored at `key` before, whose content_index
+      entry is released when the key is overwritten with different bytes.
+
+    Returns:
+    - A dict with s3_key, file_size, content_sha256, duplicate, not_modified and the
+      origin's validators, or None if the download failed or the content is not a PDF.
+    """
+    uploader = None
+    claimed_sha256 = None
+    try:
+        if not re.match(r'^https?://.*\.pdf$', cleaned_url, re.IGNORECASE):
+            logger.info(f"Not a PDF URL: {cleaned_url}")
+            return None
+
+        digest = hashlib.sha256()
+        with _get(cleaned_url, request_headers(validators), stream=True) as response:
+            if response.status_code == 304:
+                logger.info(f"PDF not modified since last fetch: {cleaned_url}")
+                return _store_result(key, None, None, validators, not_modified=True)
+            _check_response(response, cleaned_url, negative_cache)
+            origin_validators = response_validators(response)
+
+            head = b''
+            for chunk in iter_pdf_content(response, cleaned_url):
+                if uploader is None:
+                    head += chunk
+                    if len(head) < 4:
+                        continue
+                    if not is_valid_pdf(head):
+                        logger.error(f"Downloaded content is not a valid PDF: {cleaned_url}")
+                        _record_permanent_failure(negative_cache, cleaned_url, 'not_pdf')
+                        return None
+                    uploader = MultipartUploader(s3_client, bucket, key, metadata=source_metadata(cleaned_url))
+                    chunk = head
+                digest.update(chunk)
+                uploader.write(chunk)
+
+        if uploader is None:
+            logger.error(f"Downloaded content is not a valid PDF: {cleaned_url}")
+            _record_permanent_failure(negative_cache, cleaned_url, 'not_pdf')
+            return None
+
+        content_sha256 = digest.hexdigest()
+        if content_index is not None:
+            existing_key = content_index.claim(content_sha256, key, uploader.bytes_written, previous_sha256)
+            if existing_key is not None:
+                logger.info(f"Content of {cleaned_url} already stored at s3://{bucket}/{existing_key}")
+                uploader.abort()
+                return _store_result(key, uploader.bytes_written, content_sha256, origin_validators, existing_key)
+            else:
+                claimed_sha256 = content_sha256
+
+        file_size = uploader.complete()
+        return _store_result(key, file_size, content_sha256, origin_validators)
+
+    except requests.exceptions.RequestException as e:
+        logger.error(f"Failed to download PDF: {cleaned_url}, error: {e}")
+        if uploader is not None:
+            uploader.abort()
         return None
+    except Exception:
+        if uploader is not None:
+            uploader.abort()
+        if claimed_sha256 is not None:
+            content_index.release(claimed_sha256, key)
+        raise
+
+
+def transfer_pdf_to_s3(cleaned_url, s3_client, bucket, key, content_index=None, validators=None, negative_cache=None,
+                       previous_sha256=None):
+    """
+    Downloads a PDF and stores it in S3 using the configured TRANSFER_MODE.
+
+    Returns:
+    - A dict with s3_key, file_size, content_sha256, duplicate, not_modified and
+      validators (see stream_pdf_to_s3), or None if the download failed or the
+      content is not a PDF.
+
+    Raises HostUnavailable without downloading while the origin's circuit is open.
+    """
+    if TRANSFER_MODE == 'stream':
+        return stream_pdf_to_s3(cleaned_url, s3_client, bucket, key, content_index, validators, negative_cache, previous_sha256)
+
+    pdf_data, origin_validators = fetch_pdf(cleaned_url, validators, negative_cache)
+    if pdf_data is None:
+        return None
+    if pdf_data is NOT_MODIFIED:
+        return _store_result(key, None, None, validators, not_modified=True)
+
+    with pdf_data:
+        file_size = pdf_data.size
+        with pdf_data.view() as contents:
+            content_sha256 = hashlib.sha256(contents).hexdigest()
+        if content_index is not None:
+            existing_key = content_index.claim(content_sha256, key, file_size, previous_sha256)
+            if existing_key is not None:
+                logger.info(f"Content of {cleaned_url} already stored at s3://{bucket}/{existing_key}")
+                return _store_result(key, file_size, content_sha256, origin_validators, existing_key)
+            try:
+                s3_client.upload_fileobj(pdf_data, bucket, key, ExtraArgs={'Metadata': source_metadata(cleaned_url)})
+            except Exception:
+                content_index.release(content_sha256, key)
+                raise
+        else:
+            s3_client.upload_fileobj(pdf_data, bucket, key, ExtraArgs={'Metadata': source_metadata(cleaned_url)})
+    return _store_result(key, file_size, content_sha256, origin_validators)
@@ -0,0 +1,103 @@
+# spill_buffer.py
+import mmap
+import os
+import tempfile
+from contextlib import contextmanager
+from io import BytesIO
+
+# Directory spilled buffers are written to (defaults to the system temp dir, /tmp on Lambda)
+SPILL_DIR = os.getenv('SPILL_DIR') or None
+
+
+class SpillBuffer:
+    """
+    A file-like byte buffer that stays in memory until it grows past `max_memory`
+    bytes and then moves to a temporary file on disk.
+
+    Once spilled, `name` is the path of the backing file so consumers that can read
+    from a path (fitz, pdf2image) can open it directly. `view()` gives a zero-copy,
+    bytes-like view of the contents: a memoryview while in memory and a read-only
+    mmap of the file once spilled. The temporary file is removed on close.
+    """
+
+    def __init__(self, max_memory):
+        self.max_memory = max_memory
+        self.name = None
+        self._file = BytesIO()
+
+    @property
+    def spilled(self):
+        return self.name is not None
+
+    @property
+    def size(self):
+        position = self._file.tell()
+        size = self._file.seek(0, os.SEEK_END)
+        self._file.seek(position)
+        return size
+
+    def write(self, data):
+        if not self.spilled and self._file.tell() + len(data) > self.max_memory:
+            self._spill()
+        return self._file.write(data)
+
+    def _spill(self):
+        spill_file = tempfile.NamedTemporaryFile(prefix='spill-', dir=SPILL_DIR)
+        spill_file.write(self._file.getbuffer())
+        spill_file.seek(self._file.tell())
+        self._file.close()
+        self._file = spill_file
+        self.name = spill_file.name
+
+    def read(self, size=-1):
+        return self._file.read(size)
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        return self._file.seek(offset, whence)
+
+    def tell(self):
+        return self._file.tell()
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def flush(self):
+        self._file.flush()
+
+    def getvalue(self):
+        """Returns the contents as bytes. Only use this for buffers known to be small."""
+        with self.view() as contents:
+            return bytes(contents)
+
+    @contextmanager
+    def view(self):
+        """Yields a read-only bytes-like view of the contents without copying them."""
+        self._file.flush()
+        if not self.spilled:
+            contents = self._file.getbuffer()
+            read_only = contents.toreadonly()
+            try:
+                yield read_only
+            finally:
+                read_only.release()
+                contents.release()
+        elif self.size == 0:
+            yield b''
+        else:
+            contents = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                yield contents
+            finally:
+                contents.close()
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
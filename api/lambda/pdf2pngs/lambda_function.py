@@ -1,9 +1,14 @@
 import boto3
+from botocore.config import Config
 import os
 import json
 from datetime import datetime
 import logging
-from pdf2png import convert_pdf2pngs
+from pdf2png import PAGE_PROFILE, convert_pdf2pngs, count_pages, pdf_path
+from spill_buffer import SpillBuffer
+from page_manifest import PageManifest, page_prefix
+from document_state import DocumentStates, StateConflict, DOWNLOADING, RENDERING, RENDERED
+from page_uploader import PageUploader
 
 # Set up logging
 logger = logging.getLogger()
@@ -12,16 +17,45 @@ logger.setLevel(logging.INFO)
 # Specify the AWS region
 region_name = os.getenv('AWS_REGION', 'us-west-2')  # Default to 'us-west-2' if not set
 
-s3 = boto3.client('s3', region_name=region_name)
+# Pages are uploaded on PAGE_UPLOAD_WORKERS threads while the next pages render, with at most
+# PAGE_UPLOAD_WINDOW pages in flight; a failed page is retried after the others, up to PAGE_UPLOAD_ATTEMPTS times
+PAGE_UPLOAD_WORKERS = int(os.getenv('PAGE_UPLOAD_WORKERS', 8))
+PAGE_UPLOAD_WINDOW = int(os.getenv('PAGE_UPLOAD_WINDOW', PAGE_UPLOAD_WORKERS * 2))
+PAGE_UPLOAD_ATTEMPTS = int(os.getenv('PAGE_UPLOAD_ATTEMPTS', 3))
+
+# Size the S3 connection pool so the upload threads don't queue on the default of 10
+s3 = boto3.client('s3', region_name=region_name, config=Config(max_pool_connections=max(10, PAGE_UPLOAD_WORKERS + 2)))
 dynamodb = boto3.client('dynamodb', region_name=region_name)
 
 BUCKET_NAME = os.getenv('BUCKET_NAME')
 DYNAMODB_TABLE = os.getenv('DYNAMODB_TABLE')
 
+# PDFs read from S3 spill to a temp file beyond this size
+PDF_BUFFER_MAX_MEMORY = int(os.getenv('PDF_BUFFER_MAX_MEMORY', 64 * 1024 * 1024))
+
 if not BUCKET_NAME or not DYNAMODB_TABLE:
     logger.error("Environment variables BUCKET_NAME and DYNAMODB_TABLE must be set.")
     raise EnvironmentError("Required environment variables are not set.")
 
+# Documents move through the states in document_state.py, so a repeated S3 event does not render twice
+documents = DocumentStates(dynamodb, DYNAMODB_TABLE, int(os.getenv('DOCUMENT_STALE_SECONDS', 3600)))
+
+page_uploader = PageUploader(s3, PAGE_UPLOAD_WORKERS, PAGE_UPLOAD_WINDOW, PAGE_UPLOAD_ATTEMPTS)
+
+class DownloadNotRecorded(Exception):
+    """Raised when a PDF's S3 event arrives before its download is recorded, so the event is retried."""
+
+def begin_render(cleaned_url, key, request_id):
+    """Moves the document to Rendering. Returns its new version, or None if it is rendered elsewhere."""
+    item = documents.get(cleaned_url)
+    try:
+        return documents.advance(cleaned_url, RENDERING, int(item['version']['N']) if 'version' in item else None)
+    except StateConflict:
+        if item.get('status', {}).get('S') == DOWNLOADING:
+            raise DownloadNotRecorded(f"Download of {cleaned_url} is not recorded yet")
+        logger.info(f"{key} is already rendered or being rendered, skipping [Request ID: {request_id}]")
+        return None
+
 def lambda_handler(event, context):
     request_id = context.aws_request_id
     # logger.info(f"Received event: {json.dumps(event)} [Request ID: {request_id}]")
@@ -36,9 +70,8 @@ def lambda_handler(event, context):
             continue
 
         try:
-            # Get object size
-            response = s3.head_object(Bucket=bucket, Key=key)
-            object_size = response['ContentLength']
+            # The event carries the object size, so no HEAD request is needed
+            object_size = record['s3']['object']['size']
 
             # Check if the object is too large (e.g., > 1 GB)
             if object_size > 1024 * 1024 * 1024:
@@ -46,64 +79,92 @@ def lambda_handler(event, context):
                 continue  
               
             process_pdf(bucket, key, request_id)
-        except s3.exceptions.NoSuchKey:
-            logger.error(f"File {key} does not exist in bucket {bucket} [Request ID: {request_id}]")
+        except DownloadNotRecorded:
+            # Fail the invocation so Lambda retries the event
+            raise
         except Exception as e:
             logger.error(f"Error getting object {key} from bucket {bucket}: {e} [Request ID: {request_id}]")
 
 def process_pdf(bucket, key, request_id):
     # logger.info(f"process_pdf({bucket}, {key}) [Request ID: {request_id}]")
 
+    # Get the PDF file from S3
+    response = s3.get_object(Bucket=bucket, Key=key)
+
+    # The downloader names the URL whose document the object belongs to; objects stored
+    # before it did are rendered without state tracking
+    cleaned_url = response['Metadata'].get('source-url')
+    version = None
+    if cleaned_url:
+        try:
+            version = begin_render(cleaned_url, key, request_id)
+        except Exception:
+            response['Body'].close()
+            raise
+        if version is None:
+            response['Body'].close()
+            return
+
     try:
-        # Get the PDF file from S3
-        response = s3.get_object(Bucket=bucket, Key=key)
-        pdf_content = response['Body'].read()
-        response['Body'].close()  # Ensure the body is closed
-        
-        # Convert PDF to images
-        png_images = convert_pdf2pngs(pdf_content)
-        metadata_entries = []
-        
-        for i, image_buffer in enumerate(png_images, start=1):
-            try:
-                # Save each page as a PNG to S3
-                png_key = f"{key.rstrip('.pdf')}/page-{i}.png"
-                # logger.info(f"Saving page {i} to s3://{bucket}/{png_key} [Request ID: {request_id}]")
-                s3.upload_fileobj(image_buffer, bucket, png_key)
-                image_buffer.close()  # Close the buffer after uploading
-                # logger.info(f"Uploaded page {i} as PNG to s3://{bucket}/{png_key} [Request ID: {request_id}]")
-                metadata_entries.append(f"s3://{bucket}/{png_key}")
-            except Exception as e:
-                logger.error(f"Error uploading page {i} for PDF {key}: {e} [Request ID: {request_id}]")
+        with SpillBuffer(PDF_BUFFER_MAX_MEMORY) as pdf_buffer:
+            for chunk in response['Body'].iter_chunks(chunk_size=1024 * 1024):
+                pdf_buffer.write(chunk)
+            response['Body'].close()  # Ensure the body is closed
+
+            with pdf_path(pdf_buffer) as path:
+                manifest = PageManifest.for_pdf(bucket, key, count_pages(path), PAGE_PROFILE.page_template)
+
+                # Convert PDF to images, uploading each page while the next ones render;
+                # the uploader closes each page's buffer once it is in S3
+                with page_uploader.start(bucket, manifest) as uploads:
+                    for i, image_buffer in enumerate(convert_pdf2pngs(path, manifest.page_count), start=1):
+                        # Save each page image to S3
+                        page_key = page_prefix(key) + PAGE_PROFILE.page_template.format(n=i)
+                        uploads.put(i, page_key, image_buffer, image_buffer.size)
+                    uploads.finish()
 
         # Update metadata
         current_time = datetime.utcnow().isoformat()
         metadata = {
-            "pages": metadata_entries,
-            "pages_extracted_timestamp": current_time,
-            "status": "PagesExtracted"
+            "page_manifest": manifest,
+            "pages_extracted_timestamp": current_time
         }
         
         # Save metadata to DynamoDB
-        save_metadata_to_dynamodb(key, metadata)
+        save_metadata_to_dynamodb(key, metadata, cleaned_url, version)
     except Exception as e:
         logger.error(f"Error processing PDF {key}: {e} [Request ID: {request_id}]")
+        if version is not None:
+            documents.fail(cleaned_url, version, 'render_error')
 
-def save_metadata_to_dynamodb(key, metadata):
+def save_metadata_to_dynamodb(key, metadata, cleaned_url=None, version=None):
     try:
-        dynamodb.update_item(
-            TableName=DYNAMODB_TABLE,
-            Key={'url': {'S': f"s3://{BUCKET_NAME}/{key}"}},
-            UpdateExpression="set pages = :pages, pages_extracted_timestamp = :pages_extracted_timestamp, #status = :status",
-            ExpressionAttributeNames={
-                '#status': 'status'
-            },
-            ExpressionAttributeValues={
-                ':pages': {'L': [{'S': page} for page in metadata['pages']]},
-                ':pages_extracted_timestamp': {'S': metadata['pages_extracted_timestamp']},
-                ':status': {'S': metadata['status']}
-            }
-        )
+        if version is None:
+            # Untracked objects keep their metadata under the object's own URI
+            dynamodb.update_item(
+                TableName=DYNAMODB_TABLE,
+                Key={'url': {'S': f"s3://{BUCKET_NAME}/{key}"}},
+                UpdateExpression="set page_manifest = :page_manifest, pages_extracted_timestamp = :pages_extracted_timestamp, #status = :status remove pages",
+                ExpressionAttributeNames={
+                    '#status': 'status'
+                },
+                ExpressionAttributeValues={
+                    ':page_manifest': metadata['page_manifest'].to_dynamodb(s3),
+                    ':pages_extracted_timestamp': {'S': metadata['pages_extracted_timestamp']},
+                    ':status': {'S': RENDERED}
+                }
+            )
+        else:
+            documents.advance(
+                cleaned_url, RENDERED, version,
+                attributes={
+                    'page_manifest': metadata['page_manifest'].to_dynamodb(s3),
+                    'pages_extracted_timestamp': {'S': metadata['pages_extracted_timestamp']}
+                },
+                remove=('pages',)
+            )
         # logger.info(f"Metadata updated in DynamoDB table {DYNAMODB_TABLE} for PDF {key}")
+    except StateConflict:
+        logger.info(f"{cleaned_url} was taken over while it was rendered, dropping its pages metadata")
     except Exception as e:
         logger.error(f"Error updating metadata for PDF {key}: {e}")
@@ -0,0 +1,24 @@
+# page_encoder.py
+from render_profile import DEFAULT_QUALITY
+
+# Pillow format names of the page encodings in render_profile.IMAGE_EXTENSIONS
+PILLOW_FORMATS = {'png': 'PNG', 'jpeg': 'JPEG', 'webp': 'WEBP'}
+
+
+def encode_image(image, profile, output):
+    """Writes a rendered page (a PIL image) to the file object `output` in the profile's colorspace and encoding."""
+    if profile.colorspace == 'bilevel':
+        # Threshold instead of dithering, which keeps glyph edges clean
+        image = image.convert('L').point(lambda value: 255 if value >= 128 else 0, mode='1')
+    elif profile.colorspace == 'gray' and image.mode != 'L':
+        image = image.convert('L')
+    elif profile.colorspace == 'rgb' and image.mode != 'RGB':
+        image = image.convert('RGB')
+
+    options = {}
+    if profile.image_format == 'png':
+        if profile.compress_level is not None:
+            options['compress_level'] = profile.compress_level
+    else:
+        options['quality'] = profile.quality or DEFAULT_QUALITY
+    image.save(output, format=PILLOW_FORMATS[profile.image_format], **options)
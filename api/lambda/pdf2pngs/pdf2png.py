@@ -1,30 +1,79 @@
-from io import BytesIO
-from pdf2image import convert_from_bytes
+import os
+import tempfile
+from contextlib import contextmanager
+from pdf2image import convert_from_path, pdfinfo_from_path
+from spill_buffer import SpillBuffer
+from render_profile import render_profile
+from page_encoder import encode_image
 import logging
 
 # Set up logging
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-def convert_pdf2pngs(pdf_content):
+# Rendered pages spill to a temp file beyond this size
+PAGE_BUFFER_MAX_MEMORY = int(os.getenv('PAGE_BUFFER_MAX_MEMORY', 16 * 1024 * 1024))
+
+# Pages rendered per pdftoppm call; at most this many page images are held in memory at once
+PAGE_WINDOW = max(int(os.getenv('PAGE_WINDOW', 4)), 1)
+
+# Size, colorspace and encoding of the page images, picked by RENDER_PROFILE for the consumer of the pages
+PAGE_PROFILE = render_profile()
+
+@contextmanager
+def pdf_path(pdf_buffer):
     """
-    Converts PDF content to a list of PNG images.
-    
+    Yields a path to the PDF held in a SpillBuffer: its spill file, or a temp copy of an
+    in-memory buffer, written once so each page window does not copy the PDF again.
+    """
+    if pdf_buffer.spilled:
+        pdf_buffer.flush()
+        yield pdf_buffer.name
+        return
+
+    with tempfile.NamedTemporaryFile(suffix='.pdf') as pdf_file:
+        with pdf_buffer.view() as contents:
+            pdf_file.write(contents)
+        pdf_file.flush()
+        yield pdf_file.name
+
+def count_pages(path):
+    return pdfinfo_from_path(path)['Pages']
+
+def render_options(profile):
+    """The convert_from_path arguments that render at a RenderProfile's size and colorspace."""
+    options = {'grayscale': profile.colorspace != 'rgb'}
+    if profile.long_edge:
+        # pdftoppm -scale-to: fit each page in a long_edge x long_edge box
+        options['size'] = profile.long_edge
+    else:
+        options['dpi'] = profile.dpi
+    return options
+
+def convert_pdf2pngs(path, page_count, window=PAGE_WINDOW, profile=PAGE_PROFILE):
+    """
+    Renders a PDF to page images one page window at a time.
+
     Args:
-    - pdf_content (bytes): The content of the PDF file.
-    
-    Returns:
-    - List of BytesIO objects, each containing the PNG data for a single page.
+    - path (str): The path of the PDF file (see pdf_path).
+    - page_count (int): The number of pages in the PDF (see count_pages).
+    - window (int): The number of pages rendered per pdftoppm call.
+    - profile (RenderProfile): The size, colorspace and encoding of the page images.
+
+    Yields:
+    - A SpillBuffer with the encoded image of each page, in page order. The caller closes
+      each buffer, and the next window is only rendered once the current one has
+      been consumed, so memory is bounded by `window` pages rather than the document.
     """
-    images = convert_from_bytes(pdf_content)
-    logger.info(f"Number of pages: {len(images)}")
-    png_images = []
-    
-    for i, image in enumerate(images, start=1):
-        image_buffer = BytesIO()
-        image.save(image_buffer, format='PNG')
-        image_buffer.seek(0)
-        png_images.append(image_buffer)
-        logger.info(f"Converted page {i} to PNG")
-    
-    return png_images
+    logger.info(f"Number of pages: {page_count}")
+    options = render_options(profile)
+    for first_page in range(1, page_count + 1, window):
+        last_page = min(first_page + window - 1, page_count)
+        images = convert_from_path(path, first_page=first_page, last_page=last_page, **options)
+        for i, image in enumerate(images, start=first_page):
+            image_buffer = SpillBuffer(PAGE_BUFFER_MAX_MEMORY)
+            encode_image(image, profile, image_buffer)
+            image.close()
+            image_buffer.seek(0)
+            logger.info(f"Converted page {i} to {profile.image_format}")
+            yield image_buffer
@@ -0,0 +1,90 @@
+# render_profile.py
+import os
+from collections import namedtuple
+
+# PDF page sizes are in points, 72 to the inch
+POINTS_PER_INCH = 72
+
+COLORSPACES = ('rgb', 'gray', 'bilevel')
+
+# Page encodings and the file extensions they are stored under. These are the formats
+# the vision model in png2txt accepts.
+IMAGE_EXTENSIONS = {'png': 'png', 'jpeg': 'jpg', 'webp': 'webp'}
+
+# JPEG and WebP quality used when a profile does not set one
+DEFAULT_QUALITY = 80
+
+
+class RenderProfile(namedtuple(
+        'RenderProfile',
+        ['name', 'long_edge', 'dpi', 'colorspace', 'image_format', 'quality', 'compress_level'],
+        defaults=(None, None))):
+    """
+    How pages are rendered and encoded for one consumer of the page images.
+
+    - long_edge (int): Pixels on the longer side of every page, whatever its physical size;
+      None renders at `dpi` instead.
+    - dpi (int): Resolution used when there is no long_edge.
+    - colorspace (str): 'rgb', 'gray' (8-bit) or 'bilevel' (1-bit, for pages of plain text).
+    - image_format (str): 'png', 'jpeg' or 'webp'.
+    - quality (int): JPEG/WebP quality from 1 to 100 (default DEFAULT_QUALITY).
+    - compress_level (int): PNG zlib level from 0 (fastest) to 9 (smallest); None keeps the encoder's default.
+    """
+
+    def zoom(self, width, height):
+        """Scale from points to pixels for a page of width x height points."""
+        if self.long_edge:
+            return self.long_edge / max(width, height)
+        return self.dpi / POINTS_PER_INCH
+
+    @property
+    def page_template(self):
+        """The page naming template (see page_manifest.py) with this profile's file extension."""
+        return f"page-{{n}}.{IMAGE_EXTENSIONS[self.image_format]}"
+
+
+RENDER_PROFILES = {
+    # pdf2image's 200 dpi, which api/lambda/png2txt and the web viewer were built against
+    'default': RenderProfile('default', None, 200, 'rgb', 'png'),
+    # aws/png2txt sends pages with "detail": "low", for which the model scales them to fit 512x512 anyway
+    'vision': RenderProfile('vision', 512, None, 'rgb', 'png'),
+    # Text recognition engines want about 300 dpi and no color
+    'ocr': RenderProfile('ocr', None, 300, 'gray', 'png'),
+    # Black and white pages of plain text, the smallest and fastest PNGs to encode
+    'text': RenderProfile('text', None, 300, 'bilevel', 'png'),
+    # Readable on screen without zooming
+    'viewer': RenderProfile('viewer', 1600, None, 'rgb', 'png')
+}
+
+
+def render_profile(name=None):
+    """
+    Returns the named profile, by default the one named by RENDER_PROFILE ('default' if unset).
+
+    RENDER_COLORSPACE, RENDER_IMAGE_FORMAT, RENDER_IMAGE_QUALITY and RENDER_PNG_COMPRESS_LEVEL
+    override the profile's encoding when they are set.
+    """
+    name = name or os.getenv('RENDER_PROFILE', 'default')
+    try:
+        profile = RENDER_PROFILES[name]
+    except KeyError:
+        raise ValueError(f"Unknown render profile {name!r}, expected one of: {', '.join(RENDER_PROFILES)}")
+
+    overrides = {}
+    if os.getenv('RENDER_COLORSPACE'):
+        overrides['colorspace'] = os.getenv('RENDER_COLORSPACE')
+    if os.getenv('RENDER_IMAGE_FORMAT'):
+        overrides['image_format'] = os.getenv('RENDER_IMAGE_FORMAT')
+    if os.getenv('RENDER_IMAGE_QUALITY'):
+        overrides['quality'] = int(os.getenv('RENDER_IMAGE_QUALITY'))
+    if os.getenv('RENDER_PNG_COMPRESS_LEVEL'):
+        overrides['compress_level'] = int(os.getenv('RENDER_PNG_COMPRESS_LEVEL'))
+    profile = profile._replace(**overrides)
+
+    if profile.colorspace not in COLORSPACES:
+        raise ValueError(f"Unknown colorspace {profile.colorspace!r}, expected one of: {', '.join(COLORSPACES)}")
+    if profile.image_format not in IMAGE_EXTENSIONS:
+        raise ValueError(f"Unknown image format {profile.image_format!r}, expected one of: {', '.join(IMAGE_EXTENSIONS)}")
+    if profile.colorspace == 'bilevel' and profile.image_format != 'png':
+        raise ValueError("1-bit pages can only be stored as PNG")
+    return profile
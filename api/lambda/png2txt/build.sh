@@ -137,7 +137,7 @@ ACCOUNT_ID=$(aws sts get-caller-identity --query Account --output text --region
 #     --region $REGION \
 #     --profile $PROFILE
 
-# Add S3 trigger to the text extraction Lambda function
+# Add S3 triggers to the text extraction Lambda function, one per page encoding (see render_profile.py)
 echo "ACCOUNT_ID=$ACCOUNT_ID"
 echo "TEXT_EXTRACTION_LAMBDA_NAME=$TEXT_EXTRACTION_LAMBDA_NAME"
 
@@ -157,6 +157,34 @@ aws s3api put-bucket-notification-configuration --bucket $BUCKET_NAME --notifica
                     ]
                 }
             }
+        },
+        {
+            "LambdaFunctionArn": "arn:aws:lambda:${REGION}:${ACCOUNT_ID}:function:${TEXT_EXTRACTION_LAMBDA_NAME}",
+            "Events": ["s3:ObjectCreated:*"],
+            "Filter": {
+                "Key": {
+                    "FilterRules": [
+                        {
+                            "Name": "suffix",
+                            "Value": ".jpg"
+                        }
+                    ]
+                }
+            }
+        },
+        {
+            "LambdaFunctionArn": "arn:aws:lambda:${REGION}:${ACCOUNT_ID}:function:${TEXT_EXTRACTION_LAMBDA_NAME}",
+            "Events": ["s3:ObjectCreated:*"],
+            "Filter": {
+                "Key": {
+                    "FilterRules": [
+                        {
+                            "Name": "suffix",
+                            "Value": ".webp"
+                        }
+                    ]
+                }
+            }
         }
     ]
 }
@@ -13,7 +13,10 @@ load_dotenv()
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-def extract_text_from_image(image_data, api_key):
+# Page encodings written by pdf2pngs (see render_profile.py) and the MIME types they are sent as
+IMAGE_CONTENT_TYPES = {'.png': 'image/png', '.jpg': 'image/jpeg', '.webp': 'image/webp'}
+
+def extract_text_from_image(image_data, api_key, content_type='image/png'):
     headers = {
         "Content-Type": "application/json",
         "Authorization": f"Bearer {api_key}"
@@ -39,7 +42,7 @@ def extract_text_from_image(image_data, api_key):
                     {
                         "type": "image_url",
                         "image_url": {
-                            "url": f"data:image/jpeg;base64,{image_data}"
+                            "url": f"data:{content_type};base64,{image_data}"
                         }
                     }
                 ]
@@ -61,8 +64,9 @@ def lambda_handler(event, context):
         bucket = record['s3']['bucket']['name']
         key = record['s3']['object']['key']
 
-        # Only process PNG files
-        if not key.endswith('.png'):
+        # Only process page images
+        image_base, image_extension = os.path.splitext(key)
+        if image_extension not in IMAGE_CONTENT_TYPES:
             continue
 
         logger.info(f"Processing image: s3://{bucket}/{key}")
@@ -72,13 +76,13 @@ def lambda_handler(event, context):
         image_data = base64.b64encode(image_object['Body'].read()).decode('utf-8')
 
         # Extract text from image
-        extracted_text_response = extract_text_from_image(image_data, api_key)
+        extracted_text_response = extract_text_from_image(image_data, api_key, IMAGE_CONTENT_TYPES[image_extension])
 
         # Log the response for debugging
         logger.info(f"Extracted text response: {extracted_text_response}")
 
         # Save the extracted text back to S3
-        text_key = key.replace('.png', '.txt')
+        text_key = image_base + '.txt'
         s3.put_object(Bucket=bucket, Key=text_key, Body=json.dumps(extracted_text_response))
         logger.info(f"Extracted text saved to s3://{bucket}/{text_key}")
 
@@ -0,0 +1,63 @@
+# autoscaler.py
+import logging
+import math
+import threading
+import time
+
+# Configure logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+
+class QueueDepthScaler:
+    """
+    Picks how many messages to work on at once from the depth of the SQS queue.
+
+    The target is one worker per `messages_per_worker` messages in the backlog
+    (ApproximateNumberOfMessages + ApproximateNumberOfMessagesNotVisible), kept
+    within [min_concurrency, max_concurrency]. The queue attributes are read at
+    most once every `poll_interval` seconds; in between, the last target is reused.
+    """
+
+    def __init__(self, sqs_client, queue_url, min_concurrency, max_concurrency,
+                 messages_per_worker=1, poll_interval=15):
+        self.sqs = sqs_client
+        self.queue_url = queue_url
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.messages_per_worker = messages_per_worker
+        self.poll_interval = poll_interval
+        self._concurrency = min_concurrency
+        self._polled_at = None
+        self._lock = threading.Lock()
+
+    def queue_depth(self):
+        """Returns the (visible, in flight) message counts of the queue."""
+        response = self.sqs.get_queue_attributes(
+            QueueUrl=self.queue_url,
+            AttributeNames=['ApproximateNumberOfMessages', 'ApproximateNumberOfMessagesNotVisible']
+        )
+        attributes = response['Attributes']
+        return (int(attributes['ApproximateNumberOfMessages']),
+                int(attributes['ApproximateNumberOfMessagesNotVisible']))
+
+    def concurrency(self):
+        with self._lock:
+            now = time.monotonic()
+            if self._polled_at is not None and now - self._polled_at < self.poll_interval:
+                return self._concurrency
+            self._polled_at = now
+
+            try:
+                visible, in_flight = self.queue_depth()
+            except Exception as e:
+                logger.error(f"Error reading queue depth, keeping concurrency at {self._concurrency}: {e}")
+                return self._concurrency
+
+            target = math.ceil((visible + in_flight) / self.messages_per_worker)
+            target = min(max(target, self.min_concurrency), self.max_concurrency)
+            if target != self._concurrency:
+                logger.info(f"Scaling concurrency {self._concurrency} -> {target} "
+                            f"(queue: {visible} visible, {in_flight} in flight)")
+                self._concurrency = target
+            return self._concurrency
@@ -1,264 +1,806 @@
 import os
+import argparse
+import hashlib
 import json
 import boto3
+from botocore.config import Config
 import logging
 import re
+import signal
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from contextlib import contextmanager, nullcontext
+from functools import partial
 from datetime import datetime
 from io import BytesIO
-import requests
-from requests.adapters import HTTPAdapter
-from requests.packages.urllib3.util.retry import Retry
-from urllib.parse import urlparse, urlunparse, unquote
+from urllib.parse import urlparse, unquote
+from pdf_downloader import clean_url, transfer_pdf_to_s3
+from host_limiter import HostUnavailable
+from content_index import ContentIndex
+from negative_cache import NegativeCache
+from fetch_leases import FetchLeases
+from document_state import (
+    DocumentStates, StateConflict, has_completed,
+    DOWNLOADING, DOWNLOADED, RENDERING, RENDERED, EXTRACTING, DONE
+)
+from spill_buffer import SpillBuffer
+from page_manifest import PageManifest, page_prefix
+from pipeline import Stage
+from page_renderer import PageRenderer, count_pages, pdf_path, render_page
+from page_uploader import PageUploader, retry_failed_pages, upload_page
+from render_profile import render_profile
+from heartbeat import VisibilityHeartbeat
+from supervisor import Supervisor
+from autoscaler import QueueDepthScaler
 import fitz  # PyMuPDF
 
 # Configure logging
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-s3 = boto3.client('s3')
-sqs = boto3.client('sqs')
-dynamodb = boto3.client('dynamodb')
+# Number of messages processed at once, and the most of those allowed against a single origin host
+download_concurrency = int(os.getenv('DOWNLOAD_CONCURRENCY', 8))
+per_host_concurrency = int(os.getenv('PER_HOST_CONCURRENCY', 2))
+
+# 'pipeline' runs download, render, page upload and metadata as overlapping stages;
+# 'batch' downloads everything first and renders afterwards
+processing_mode = os.getenv('PROCESSING_MODE', 'pipeline')
+render_workers = int(os.getenv('RENDER_WORKERS', 2))
+page_upload_workers = int(os.getenv('PAGE_UPLOAD_WORKERS', 8))
+metadata_workers = int(os.getenv('METADATA_WORKERS', 2))
+
+# Rendering only waits on page uploads once PAGE_UPLOAD_WINDOW pages are in flight; a failed page
+# upload is retried after the PDF's other pages, up to PAGE_UPLOAD_ATTEMPTS attempts in all
+page_upload_window = int(os.getenv('PAGE_UPLOAD_WINDOW', page_upload_workers * 2))
+page_upload_attempts = int(os.getenv('PAGE_UPLOAD_ATTEMPTS', 3))
+
+# Daemon mode keeps polling through empty receives and scales the number of messages worked on
+# between MIN_CONCURRENCY and MAX_CONCURRENCY with the queue depth, exiting only after
+# IDLE_SHUTDOWN_SECONDS without any messages
+daemon_mode = os.getenv('DAEMON_MODE', 'false').lower() == 'true'
+min_concurrency = int(os.getenv('MIN_CONCURRENCY', 1))
+max_concurrency = int(os.getenv('MAX_CONCURRENCY', download_concurrency))
+messages_per_worker = int(os.getenv('MESSAGES_PER_WORKER', 2))
+scale_interval = int(os.getenv('SCALE_INTERVAL_SECONDS', 15))
+idle_shutdown_seconds = int(os.getenv('IDLE_SHUTDOWN_SECONDS', 300))
+message_workers = max_concurrency if daemon_mode else download_concurrency
+
+# PDFs read back from S3 for rendering spill to a temp file beyond this size
+pdf_buffer_max_memory = int(os.getenv('PDF_BUFFER_MAX_MEMORY', 64 * 1024 * 1024))
+
+# Size, colorspace and encoding of the page images, picked by RENDER_PROFILE for the consumer of the pages
+page_profile = render_profile()
+
+# RENDER_PROCESSES > 1 renders the pages of each PDF in parallel on a pool of that many processes,
+# RENDER_PAGES_PER_TASK pages at a time; otherwise pages are rendered one by one on the calling thread
+render_processes = int(os.getenv('RENDER_PROCESSES', 0))
+page_renderer = PageRenderer(
+    render_processes, int(os.getenv('RENDER_PAGES_PER_TASK', 8))
+) if render_processes > 1 else None
+
+# Size the connection pools so concurrent workers don't queue on the default of 10
+client_config = Config(max_pool_connections=max(10, message_workers * 4 + page_upload_workers))
+s3 = boto3.client('s3', config=client_config)
+sqs = boto3.client('sqs', config=client_config)
+dynamodb = boto3.client('dynamodb', config=client_config)
+page_uploader = PageUploader(s3, page_upload_workers, page_upload_window, page_upload_attempts)
 bucket_name = os.getenv('BUCKET_NAME')
 queue_url = os.getenv('QUEUE_URL')
 dynamodb_table = os.getenv('DYNAMODB_TABLE')
 
+# Documents move through the states in document_state.py, so redelivered work skips the stages already done;
+# an in-progress state left for DOCUMENT_STALE_SECONDS can be taken over
+documents = DocumentStates(dynamodb, dynamodb_table, int(os.getenv('DOCUMENT_STALE_SECONDS', 3600)))
+
+# Optional PNG-to-text state machine (aws/png2txt) started for each rendered document
+state_machine_arn = os.getenv('STATE_MACHINE_ARN')
+step_functions = boto3.client('stepfunctions') if state_machine_arn else None
+
+# Received messages stay invisible for this long, extended by the heartbeat while their work runs
+visibility_timeout = int(os.getenv('VISIBILITY_TIMEOUT', 60))
+heartbeat_interval = float(os.getenv('HEARTBEAT_INTERVAL', 0)) or None
+heartbeat = VisibilityHeartbeat(sqs, queue_url, visibility_timeout, heartbeat_interval)
+
+# Optional SHA-256 -> S3 key index used to store and render each distinct PDF only once
+content_index_table = os.getenv('CONTENT_INDEX_TABLE')
+content_index = ContentIndex(dynamodb, content_index_table) if content_index_table else None
+
+# Optional cache of URLs that failed permanently (404, not a PDF, ...), which are then dropped without a fetch
+negative_cache_table = os.getenv('NEGATIVE_CACHE_TABLE')
+negative_cache = NegativeCache(
+    dynamodb, negative_cache_table,
+    int(os.getenv('NEGATIVE_CACHE_TTL_SECONDS', 7 * 24 * 3600)),
+    int(os.getenv('NEGATIVE_CACHE_LOCAL_SIZE', 10000))
+) if negative_cache_table else None
+
+# Optional single-flight leases so concurrent messages for the same URL fetch and render it only once
+fetch_lease_table = os.getenv('FETCH_LEASE_TABLE')
+fetch_leases = FetchLeases(
+    dynamodb, fetch_lease_table, int(os.getenv('FETCH_LEASE_SECONDS', 900))
+) if fetch_lease_table else None
+
+scaler = QueueDepthScaler(
+    sqs, queue_url, min_concurrency, max_concurrency, messages_per_worker, scale_interval
+) if daemon_mode else None
+
+# Set on SIGTERM/SIGINT: stop receiving and finish the messages already received
+shutdown_requested = threading.Event()
+
 # Check for required environment variables
 if not all([bucket_name, queue_url, dynamodb_table]):
     logger.error("One or more required environment variables are missing.")
     raise ValueError("Missing required environment variables.")
 
-# Setup requests session with retries
-session = requests.Session()
-retry = Retry(
-    total=5,
-    backoff_factor=0.3,
-    status_forcelist=(500, 502, 504),
-)
-adapter = HTTPAdapter(max_retries=retry)
-session.mount('http://', adapter)
-session.mount('https://', adapter)
 
+class HostSemaphores:
+    """Limits the number of concurrent downloads from any single host."""
 
-def is_valid_pdf(content):
-    return content.startswith(b'%PDF')
+    def __init__(self, limit):
+        self.limit = limit
+        self._semaphores = {}
+        self._lock = threading.Lock()
 
+    @contextmanager
+    def acquire(self, host):
+        with self._lock:
+            semaphore = self._semaphores.setdefault(host, threading.Semaphore(self.limit))
+        with semaphore:
+            yield
 
-def clean_url(pdf_url):
-    parsed_url = urlparse(pdf_url)
-    cleaned_url = urlunparse(parsed_url._replace(query='', fragment=''))
-    return cleaned_url
 
+host_slots = HostSemaphores(per_host_concurrency)
 
-def download_pdf(cleaned_url):
-    try:
-        if not re.match(r'^https?://.*\.pdf$', cleaned_url, re.IGNORECASE):
-            logger.info(f"Not a PDF URL: {cleaned_url}")
-            return None
 
-        headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3'}
-        response = session.get(cleaned_url, headers=headers, stream=True)
-        response.raise_for_status()
+def concurrency_limit():
+    """Number of messages to work on at once: fixed, or scaled with the queue depth in daemon mode."""
+    return scaler.concurrency() if daemon_mode else download_concurrency
 
-        pdf_data = BytesIO()
-        for chunk in response.iter_content(chunk_size=1024):
-            pdf_data.write(chunk)
-        pdf_data.seek(0)
 
-        if not is_valid_pdf(pdf_data.read(4)):
-            logger.error(f"Downloaded content is not a valid PDF: {cleaned_url}")
-            return None
+class IdleTimer:
+    """Decides when a receive loop should stop after its receives come back empty."""
+
+    def __init__(self):
+        self.last_message_at = time.monotonic()
+
+    def received(self, messages):
+        if messages:
+            self.last_message_at = time.monotonic()
+
+    def expired(self):
+        # Outside daemon mode the first empty long poll ends the run
+        if not daemon_mode:
+            return True
+        return time.monotonic() - self.last_message_at >= idle_shutdown_seconds
+
+
+def rendered_state(item):
+    """The state an unchanged document goes back to: Done or Rendered, or None if its pages were never rendered."""
+    if item.get('status', {}).get('S') == DONE:
+        return DONE
+    return RENDERED if has_completed(item, RENDERED) else None
+
+
+def cached_validators(item):
+    """
+    Returns the ETag/Last-Modified recorded the last time the document's URL was downloaded.
+
+    Documents whose pages were never rendered are fetched unconditionally, since a 304
+    would leave them with nothing to render.
+    """
+    if rendered_state(item) is None:
+        return {}
+    return {name: item[name]['S'] for name in ('etag', 'last_modified') if name in item}
+
+
+def validator_attributes(validators):
+    """The origin's validators as item attributes, so the next fetch of the URL can be conditional."""
+    attributes = {}
+    if validators.get('etag'):
+        attributes['etag'] = {'S': validators['etag']}
+    if validators.get('last_modified'):
+        attributes['last_modified'] = {'S': validators['last_modified']}
+    if validators.get('content_length'):
+        attributes['content_length'] = {'N': validators['content_length']}
+    return attributes
+
+
+def item_version(item):
+    return int(item['version']['N']) if 'version' in item else None
+
+
+def stored_document(cleaned_url, item, version):
+    """The (url, key, size, version) tuple to render for a document whose PDF is already in S3."""
+    key = urlparse(item['s3_uri']['S']).path.lstrip('/')
+    return cleaned_url, key, int(item['file_size']['N']), version
+
+
+def save_download_metadata(cleaned_url, object_name, result, version):
+    """
+    Records a finished download and moves the document on from Downloading.
+
+    Content already stored for another URL was rendered there, so the document is
+    Done; otherwise it is Downloaded and ready to render. Returns the new version.
+    """
+    # Point at the existing object when the same bytes were already stored
+    stored_key = result['s3_key']
+    duplicate = stored_key != object_name
+
+    # Construct S3 URI
+    s3_uri = f"s3://{bucket_name}/{stored_key}"
+
+    # Save metadata to DynamoDB
+    current_time = datetime.utcnow().isoformat()
+    # The downloader counted the bytes while storing them
+    file_size = result['file_size']
+
+    attributes = {
+        's3_uri': {'S': s3_uri},
+        'duplicate': {'BOOL': duplicate},
+        'downloaded_timestamp': {'S': current_time},
+        'file_size': {'N': str(file_size)},
+        'content_sha256': {'S': result['content_sha256']},
+        **validator_attributes(result['validators'])
+    }
+
+    # Wait for the write so the message is only acked once its metadata is stored
+    version = documents.advance(cleaned_url, DONE if duplicate else DOWNLOADED, version, attributes=attributes)
+    logger.info(f"Metadata saved to DynamoDB for URL: {cleaned_url}")
+    return version
+
+
+def download_message(record):
+    """
+    Downloads the PDF referenced by one SQS message, stores it in S3 and records its metadata.
 
-        pdf_data.seek(0)
-        return pdf_data
+    Returns:
+    - A (url, key, size, version) tuple for the stored PDF, or None if the message was
+      not processed or there is nothing new to render (the PDF is unchanged since its
+      pages were rendered, stored for another URL, or already rendered for an earlier
+      delivery of the message).
+    """
+    message_body = record['Body']
+    logger.info(f"Processing message: {message_body}")
 
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Failed to download PDF: {cleaned_url}, error: {e}")
+    cleaned_url = clean_url(message_body)
+    if not re.match(r'^https?://.*\.pdf$', cleaned_url, re.IGNORECASE):
+        logger.warning(f"Message is not a PDF URL: {message_body}")
         return None
-    except ValueError as e:
-        logger.error(f"Invalid PDF content from URL: {cleaned_url}, error: {e}")
+
+    try:
+        # Retrying will not fix a URL that already failed permanently
+        failure_class = negative_cache.lookup(cleaned_url) if negative_cache else None
+        if failure_class:
+            logger.info(f"Skipping URL that failed permanently ({failure_class}): {cleaned_url}")
+            remove_message(record)
+            return None
+
+        lease = fetch_leases.hold(cleaned_url, record['MessageId']) if fetch_leases else nullcontext(True)
+        with lease as acquired:
+            if not acquired:
+                # The worker holding the lease keeps its own message until the fetch succeeds
+                logger.info(f"URL is already being fetched by another worker, skipping: {cleaned_url}")
+                remove_message(record)
+                return None
+
+            parsed_url = urlparse(cleaned_url)
+            hostname = parsed_url.netloc.replace('.', '_')
+            base_name = os.path.basename(unquote(parsed_url.path)).replace('.pdf', '')
+            object_name = f"{hostname}/{base_name}/{base_name}.pdf"
+
+            item = documents.get(cleaned_url)
+            if item.get('message_id', {}).get('S') == record['MessageId'] and has_completed(item, DOWNLOADED):
+                # An earlier delivery of this message already stored the PDF
+                logger.info(f"Download of {cleaned_url} already completed, skipping it")
+                remove_message(record)
+                if item['status']['S'] == DOWNLOADED:
+                    return stored_document(cleaned_url, item, item_version(item))
+                return None
+
+            try:
+                version = documents.advance(cleaned_url, DOWNLOADING, item_version(item), record['MessageId'])
+            except StateConflict:
+                logger.info(f"Document is being processed by another worker, skipping: {cleaned_url}")
+                remove_message(record)
+                return None
+
+            # Download the PDF and upload it to S3, unless it is unchanged since the last fetch
+            with host_slots.acquire(parsed_url.netloc):
+                result = transfer_pdf_to_s3(
+                    cleaned_url, s3, bucket_name, object_name, content_index, cached_validators(item), negative_cache,
+                    item.get('content_sha256', {}).get('S')
+                )
+            if result is None:
+                logger.error(f"Failed to download or validate the PDF: {cleaned_url}")
+                # Only failures that may be transient are worth a redelivery
+                failure_class = negative_cache.lookup(cleaned_url, local_only=True) if negative_cache else None
+                if failure_class:
+                    documents.fail(cleaned_url, version, failure_class)
+                    remove_message(record)
+                return None
+
+            # A 304, or bytes the content index already has under this URL's own key, upload nothing
+            if result['not_modified'] or result['duplicate'] and result['s3_key'] == object_name:
+                state = rendered_state(item)
+                if state is not None:
+                    logger.info(f"PDF unchanged since last download: {cleaned_url}")
+                    # Unchanged content keeps the pages already rendered from it
+                    documents.advance(cleaned_url, state, version, attributes=validator_attributes(result['validators']))
+                    remove_message(record)
+                    return None
+                if result['not_modified']:
+                    # Render the copy stored by the earlier download
+                    version = documents.advance(cleaned_url, DOWNLOADED, version)
+                    remove_message(record)
+                    return stored_document(cleaned_url, item, version)
+
+            logger.info(f"PDF stored at s3://{bucket_name}/{result['s3_key']}")
+            version = save_download_metadata(cleaned_url, object_name, result, version)
+            remove_message(record)
+
+            # Content stored for another URL has already been rendered and sent for OCR
+            if result['s3_key'] != object_name:
+                return None
+            return cleaned_url, object_name, result['file_size'], version
+    except HostUnavailable as e:
+        # Keep the message hidden until the host's circuit closes again
+        logger.warning(f"Parking {cleaned_url}: {e}")
+        park_message(record['ReceiptHandle'], e.retry_after)
+        return None
+    except Exception as e:
+        logger.error(f"Error processing PDF URL {cleaned_url}: {e}", exc_info=True)
         return None
 
 
-def process_messages():
-    list_of_s3s = []
+def remove_message(record):
+    sqs.delete_message(
+        QueueUrl=queue_url,
+        ReceiptHandle=record['ReceiptHandle']
+    )
+    logger.info(f"Message removed from the queue: {record['Body']}")
+
+
+def park_message(receipt_handle, delay):
+    """Hides a message for `delay` seconds (at most the SQS limit of 12 hours) before it is redelivered."""
+    # Stop the heartbeat first so it does not shorten the new timeout
+    heartbeat.untrack(receipt_handle)
     try:
-        while True:
-            response = sqs.receive_message(
-                QueueUrl=queue_url,
-                MaxNumberOfMessages=10,
-                WaitTimeSeconds=20,
-                VisibilityTimeout=60  # Add visibility timeout to handle processing failures
-            )
-
-            if 'Messages' not in response:
-                logger.info("No messages in queue")
-                break
-
-            for record in response['Messages']:
-                message_body = record['Body']
-                logger.info(f"Processing message: {message_body}")
-
-                cleaned_url = clean_url(message_body)
-                if re.match(r'^https?://.*\.pdf$', cleaned_url, re.IGNORECASE):
-                    try:
-                        pdf_data = download_pdf(cleaned_url)
-                        if pdf_data:
-                            parsed_url = urlparse(cleaned_url)
-                            hostname = parsed_url.netloc.replace('.', '_')
-                            base_name = os.path.basename(unquote(parsed_url.path)).replace('.pdf', '')
-                            object_name = f"{hostname}/{base_name}/{base_name}.pdf"
-
-                            # Upload PDF to S3
-                            s3.upload_fileobj(pdf_data, bucket_name, object_name)
-                            logger.info(f"PDF saved to S3: s3://{bucket_name}/{object_name}")
-
-                            list_of_s3s.append(object_name)
-
-                            # Construct S3 URI
-                            s3_uri = f"s3://{bucket_name}/{object_name}"
-
-                            # Save metadata to DynamoDB
-                            current_time = datetime.utcnow().isoformat()
-                            response = s3.head_object(Bucket=bucket_name, Key=object_name)
-                            file_size = response['ContentLength']
-
-                            dynamodb.put_item(
-                                TableName=dynamodb_table,
-                                Item={
-                                    'url': {'S': cleaned_url},
-                                    's3_uri': {'S': s3_uri},
-                                    'status': {'S': 'Downloaded'},
-                                    'downloaded_timestamp': {'S': current_time},
-                                    'file_size': {'N': str(file_size)}
-                                }
-                            )
-                            logger.info(f"Metadata saved to DynamoDB for URL: {cleaned_url}")
-
-                            # Remove the message from the queue
-                            receipt_handle = record['ReceiptHandle']
-                            sqs.delete_message(
-                                QueueUrl=queue_url,
-                                ReceiptHandle=receipt_handle
-                            )
-                            logger.info(f"Message removed from the queue: {message_body}")
-                        else:
-                            logger.error(f"Failed to download or validate the PDF: {cleaned_url}")
-                    except Exception as e:
-                        logger.error(f"Error processing PDF URL {cleaned_url}: {e}", exc_info=True)
-                else:
-                    logger.warning(f"Message is not a PDF URL: {message_body}")
+        sqs.change_message_visibility(
+            QueueUrl=queue_url,
+            ReceiptHandle=receipt_handle,
+            VisibilityTimeout=min(int(delay) + 1, 12 * 3600)
+        )
     except Exception as e:
-        logger.error(f"Error processing messages: {e}", exc_info=True)
+        logger.error(f"Error parking message: {e}", exc_info=True)
+
+
+def process_message(record):
+    """Runs download_message, then stops extending the message's visibility."""
+    try:
+        return download_message(record)
+    finally:
+        # The message has either been deleted or is left to reappear for a retry
+        heartbeat.untrack(record['ReceiptHandle'])
+
+
+def receive_messages(max_messages):
+    """Receives up to max_messages messages and keeps them invisible until they are processed."""
+    response = sqs.receive_message(
+        QueueUrl=queue_url,
+        MaxNumberOfMessages=max_messages,
+        WaitTimeSeconds=20,
+        VisibilityTimeout=visibility_timeout  # Add visibility timeout to handle processing failures
+    )
+    messages = response.get('Messages', [])
+    for record in messages:
+        heartbeat.track(record['ReceiptHandle'])
+    return messages
+
+
+def process_messages():
+    """
+    Drains the queue, processing up to concurrency_limit() messages at a time.
+
+    A new receive is issued as soon as there are free worker slots, so the next
+    batch starts while the previous one is still downloading. Returns a
+    (url, key, size, version) tuple for each PDF to render.
+    """
+    list_of_s3s = []
+    in_flight = set()
+    idle = IdleTimer()
+    with ThreadPoolExecutor(max_workers=message_workers) as executor:
+        try:
+            while not shutdown_requested.is_set():
+                free_slots = concurrency_limit() - len(in_flight)
+                if free_slots <= 0:
+                    done, in_flight = wait(in_flight, timeout=scale_interval, return_when=FIRST_COMPLETED)
+                    list_of_s3s.extend(f.result() for f in done if f.result())
+                    continue
+
+                messages = receive_messages(min(10, free_slots))
+                idle.received(messages)
+                if not messages:
+                    if not in_flight:
+                        if idle.expired():
+                            logger.info("No messages in queue")
+                            break
+                        continue
+                    done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    list_of_s3s.extend(f.result() for f in done if f.result())
+                    continue
+
+                for record in messages:
+                    in_flight.add(executor.submit(process_message, record))
+        except Exception as e:
+            logger.error(f"Error processing messages: {e}", exc_info=True)
+
+        done, _ = wait(in_flight)
+        list_of_s3s.extend(f.result() for f in done if f.result())
 
     return list_of_s3s
 
 
+def is_renderable(key, object_size):
+    """Checks that a stored PDF is small enough to render, using the size counted while storing it."""
+    if not key.lower().endswith('.pdf'):
+        logger.info(f"Skipping non-PDF file: {key}")
+        return False
+
+    # Check if the object is too large (e.g., > 1 GB)
+    if object_size > 1024 * 1024 * 1024:
+        logger.error(f"File {key} is too large to process: {object_size} bytes")
+        return False
+    return True
+
+
+def begin_render(stored):
+    """
+    Moves a stored document to Rendering. Returns its new version, or None if it must
+    not be rendered here: another worker got to it first, or the PDF cannot be rendered.
+    """
+    cleaned_url, key, object_size, version = stored
+    try:
+        version = documents.advance(cleaned_url, RENDERING, version)
+    except StateConflict:
+        logger.info(f"{key} is already rendered or being rendered, skipping")
+        return None
+
+    if not is_renderable(key, object_size):
+        documents.fail(cleaned_url, version, 'not_renderable')
+        return None
+    return version
+
+
 def png_process(list_of_s3s):
     logger.info(f"png_process: {list_of_s3s}")
 
-    for key in list_of_s3s:
-        if not key.lower().endswith('.pdf'):
-            logger.info(f"Skipping non-PDF file: {key}")
-            continue
+    for stored in list_of_s3s:
+        process_pdf(bucket_name, stored)
 
-        try:
-            # Get object size
-            response = s3.head_object(Bucket=bucket_name, Key=key)
-            object_size = response['ContentLength']
 
-            # Check if the object is too large (e.g., > 1 GB)
-            if object_size > 1024 * 1024 * 1024:
-                logger.error(f"File {key} is too large to process: {object_size} bytes")
-                continue
+def open_pdf_document(pdf_buffer):
+    """Opens a PDF held in a SpillBuffer, reading it from the spill file when it is on disk."""
+    if pdf_buffer.spilled:
+        pdf_buffer.flush()
+        return fitz.open(pdf_buffer.name, filetype="pdf")
+    return fitz.open(stream=pdf_buffer.getvalue(), filetype="pdf")
 
-            process_pdf(bucket_name, key)
-        except s3.exceptions.NoSuchKey:
-            logger.error(f"File {key} does not exist in bucket {bucket_name}")
-        except Exception as e:
-            logger.error(f"Error getting object {key} from bucket {bucket_name}: {e}")
+
+def read_pdf_from_s3(bucket, key):
+    """Reads a stored PDF into a SpillBuffer. The caller closes the buffer."""
+    pdf_buffer = SpillBuffer(pdf_buffer_max_memory)
+    response = s3.get_object(Bucket=bucket, Key=key)
+    for chunk in response['Body'].iter_chunks(chunk_size=1024 * 1024):
+        pdf_buffer.write(chunk)
+    response['Body'].close()  # Ensure the body is closed
+    logger.info("PDF downloaded from S3")
+    return pdf_buffer
+
+
+def page_image_key(key, page_number):
+    return page_prefix(key) + page_profile.page_template.format(n=page_number)
 
 
-def convert_pdf2pngs(pdf_content, bucket, key):
+@contextmanager
+def rendered_pages(pdf_buffer):
+    """
+    Renders a PDF held in a SpillBuffer.
+
+    Yields:
+    - A (page_count, pages) tuple, where pages iterates over the image bytes of each page
+      in page order, rendered and encoded with `page_profile`. Pages are rendered as the iterator is
+      consumed, on the render process pool when there is one.
+    """
+    if page_renderer is None:
+        pdf_document = open_pdf_document(pdf_buffer)
+        try:
+            yield len(pdf_document), (render_page(pdf_document, i, page_profile) for i in range(len(pdf_document)))
+        finally:
+            pdf_document.close()
+        return
+
+    with pdf_path(pdf_buffer) as path:
+        page_count = count_pages(path)
+        pages = page_renderer.render(path, page_count, page_profile)
+        try:
+            yield page_count, pages
+        finally:
+            pages.close()
+
+
+def convert_pdf2pngs(pdf_buffer, bucket, key):
     """
     Converts PDF content to PNG images and uploads each page to S3.
 
     Args:
-    - pdf_content (bytes): The content of the PDF file.
+    - pdf_buffer (SpillBuffer): The content of the PDF file.
     - bucket (str): The name of the S3 bucket.
     - key (str): The S3 key for the original PDF file.
+
+    Returns:
+    - PageManifest: The pages that were uploaded.
     """
     logger.info("Enter convert_pdf2pngs")
 
     # Open the PDF file with PyMuPDF
-    pdf_document = fitz.open(stream=pdf_content, filetype="pdf")
-    logger.info("PDF document opened")
-
-    metadata_entries = []
-    for i in range(len(pdf_document)):
-        page = pdf_document.load_page(i)
-        pix = page.get_pixmap()
-        image_buffer = BytesIO(pix.tobytes(output="png"))
-        png_key = f"{key.rstrip('.pdf')}/page-{i + 1}.png"
-        
-        try:
-            # Save each page as a PNG to S3
-            s3.upload_fileobj(image_buffer, bucket, png_key)
-            metadata_entries.append(f"s3://{bucket}/{png_key}")
-            logger.info(f"Uploaded page {i + 1} to S3")
-        except Exception as e:
-            logger.error(f"Error uploading page {i + 1} for PDF {key}: {e}")
+    with rendered_pages(pdf_buffer) as (page_count, pages):
+        logger.info("PDF document opened")
+
+        manifest = PageManifest.for_pdf(bucket, key, page_count, page_profile.page_template)
+        with page_uploader.start(bucket, manifest) as uploads:
+            for i, page_data in enumerate(pages):
+                # Save each page image to S3 while the next one renders
+                uploads.put(i + 1, page_image_key(key, i + 1), BytesIO(page_data), len(page_data))
+            uploads.finish()
+        logger.info(f"Uploaded {sum(size is not None for size in manifest.sizes)} of {page_count} pages to S3")
+
+    return manifest
+
 
-    return metadata_entries
+def pages_extracted_metadata(manifest):
+    current_time = datetime.utcnow().isoformat()
+    return {
+        "page_manifest": manifest,
+        "pages_extracted_timestamp": current_time
+    }
 
 
-def process_pdf(bucket, key):
+def process_pdf(bucket, stored):
+    cleaned_url, key, _, _ = stored
     logger.info(f"process_pdf({bucket}, {key})")
+    version = begin_render(stored)
+    if version is None:
+        return
     try:
-        # Get the PDF file from S3
-        response = s3.get_object(Bucket=bucket, Key=key)
-        pdf_content = response['Body'].read()
-        response['Body'].close()  # Ensure the body is closed
-        logger.info("PDF downloaded from S3")
-
-        # Convert PDF to images
-        metadata_entries = convert_pdf2pngs(pdf_content, bucket, key)
-        logger.info("PDF conversion to PNG completed")
-
-        # Update metadata
-        current_time = datetime.utcnow().isoformat()
-        metadata = {
-            "pages": metadata_entries,
-            "pages_extracted_timestamp": current_time,
-            "status": "PagesExtracted"
-        }
+        with read_pdf_from_s3(bucket, key) as pdf_buffer:
+            # Convert PDF to images
+            manifest = convert_pdf2pngs(pdf_buffer, bucket, key)
+            logger.info("PDF conversion to PNG completed")
 
         # Save metadata to DynamoDB
-        save_metadata_to_dynamodb(key, metadata)
+        save_metadata_to_dynamodb(cleaned_url, version, pages_extracted_metadata(manifest))
     except Exception as e:
         logger.error(f"Error processing PDF {key}: {e}", exc_info=True)
+        documents.fail(cleaned_url, version, 'render_error')
 
 
-def save_metadata_to_dynamodb(key, metadata):
+def save_metadata_to_dynamodb(cleaned_url, version, metadata):
+    """
+    Records the rendered pages and moves the document from Rendering to Rendered,
+    then starts text extraction if it is configured.
+
+    Pages are stored as a compact `page_manifest` map (see page_manifest.py) in place of
+    the `pages` list of S3 URIs written by earlier versions, which is removed.
+    """
     try:
-        dynamodb.update_item(
-            TableName=dynamodb_table,
-            Key={'url': {'S': f"s3://{bucket_name}/{key}"}},
-            UpdateExpression="set pages = :pages, pages_extracted_timestamp = :pages_extracted_timestamp, #status = :status",
-            ExpressionAttributeNames={
-                '#status': 'status'
+        version = documents.advance(
+            cleaned_url, RENDERED, version,
+            attributes={
+                'page_manifest': metadata['page_manifest'].to_dynamodb(s3),
+                'pages_extracted_timestamp': {'S': metadata['pages_extracted_timestamp']}
             },
-            ExpressionAttributeValues={
-                ':pages': {'L': [{'S': page} for page in metadata['pages']]},
-                ':pages_extracted_timestamp': {'S': metadata['pages_extracted_timestamp']},
-                ':status': {'S': metadata['status']}
-            }
+            remove=('pages',)
         )
-        logger.info(f"Metadata updated in DynamoDB table {dynamodb_table} for PDF {key}")
+        logger.info(f"Metadata updated in DynamoDB table {dynamodb_table} for {cleaned_url}")
+    except StateConflict:
+        logger.info(f"{cleaned_url} was taken over while it was rendered, dropping its pages metadata")
+        return
+    except Exception as e:
+        logger.error(f"Error updating metadata for {cleaned_url}: {e}", exc_info=True)
+        return
+    start_extraction(cleaned_url, version, metadata['page_manifest'])
+
+
+def start_extraction(cleaned_url, version, manifest):
+    """Moves a rendered document to Extracting and starts the PNG-to-text state machine on its pages."""
+    if not state_machine_arn:
+        return
+    try:
+        version = documents.advance(cleaned_url, EXTRACTING, version)
+    except StateConflict:
+        logger.info(f"Text extraction of {cleaned_url} was already started")
+        return
+
+    try:
+        response = step_functions.start_execution(
+            stateMachineArn=state_machine_arn,
+            # One execution name per document version, so a repeated start does not run twice
+            name=f"{hashlib.sha256(cleaned_url.encode('utf-8')).hexdigest()}-{version}",
+            input=json.dumps({
+                'pageManifest': manifest.to_json(),
+                'documentUrl': cleaned_url,
+                'documentVersion': version
+            })
+        )
+        logger.info(f"Step Functions state machine triggered: {response['executionArn']}")
+    except Exception as e:
+        logger.error(f"Error triggering Step Functions for {cleaned_url}: {e}", exc_info=True)
+        documents.fail(cleaned_url, version, 'extraction_not_started')
+
+
+class RenderedDocument:
+    """
+    Collects the page uploads of one PDF so its metadata is written once the last page
+    is in S3. Pages whose upload failed are kept in `failed` to be retried at the end.
+    """
+
+    def __init__(self, bucket, key, page_count, cleaned_url, version):
+        self.bucket = bucket
+        self.key = key
+        self.cleaned_url = cleaned_url
+        self.version = version
+        self.manifest = PageManifest.for_pdf(bucket, key, page_count, page_profile.page_template)
+        self.failed = {}
+        self._remaining = page_count
+        self._lock = threading.Lock()
+
+    def page_done(self, page_index, size):
+        """Records one page's upload (size is None if it failed). Returns True for the last page."""
+        self.manifest.page_done(page_index + 1, size)
+        with self._lock:
+            self._remaining -= 1
+            return self._remaining == 0
+
+    def page_failed(self, page_index, page_key, body, size):
+        with self._lock:
+            self.failed[page_index + 1] = (page_key, body, size)
+
+
+def download_stage_handler(record, render_stage):
+    stored = process_message(record)
+    if stored:
+        render_stage.put(stored)
+
+
+def render_stage_handler(stored, page_upload_stage, metadata_stage):
+    cleaned_url, key, _, _ = stored
+    version = begin_render(stored)
+    if version is None:
+        return
+
+    try:
+        with read_pdf_from_s3(bucket_name, key) as pdf_buffer, rendered_pages(pdf_buffer) as (page_count, pages):
+            document = RenderedDocument(bucket_name, key, page_count, cleaned_url, version)
+            if page_count == 0:
+                metadata_stage.put(document)
+            for i, page_data in enumerate(pages):
+                page_upload_stage.put((document, i, page_data))
+    except Exception:
+        documents.fail(cleaned_url, version, 'render_error')
+        raise
+    logger.info(f"Rendered {document.manifest.page_count} pages of {key}")
+
+
+def page_upload_stage_handler(item, metadata_stage):
+    document, page_index, page_data = item
+    page_key = page_image_key(document.key, page_index + 1)
+    body = BytesIO(page_data)
+    size = None
+    try:
+        # Save the page image to S3
+        upload_page(s3, document.bucket, page_key, body)
+        size = len(page_data)
+    except Exception as e:
+        logger.warning(f"Error uploading page {page_index + 1} for PDF {document.key}, will retry: {e}")
+        document.page_failed(page_index, page_key, body, len(page_data))
+
+    if document.page_done(page_index, size):
+        retry_failed_pages(s3, document.bucket, document.manifest, document.failed, page_upload_attempts - 1)
+        metadata_stage.put(document)
+
+
+def metadata_stage_handler(document):
+    save_metadata_to_dynamodb(document.cleaned_url, document.version, pages_extracted_metadata(document.manifest))
+
+
+def run_pipeline():
+    """
+    Runs receive -> download/upload -> render -> page upload -> metadata as concurrent stages.
+
+    Each stage has its own worker count and a bounded input queue, so rendering
+    starts as soon as the first PDF is stored and a slow stage holds back the
+    ones before it instead of letting work pile up in memory. Receiving stops
+    after one empty long poll (in daemon mode, after IDLE_SHUTDOWN_SECONDS without
+    messages); everything already received is then drained.
+    """
+    metadata_stage = Stage('metadata', metadata_stage_handler, metadata_workers, 100).start()
+    page_upload_stage = Stage(
+        'page-upload',
+        partial(page_upload_stage_handler, metadata_stage=metadata_stage),
+        page_upload_workers, page_upload_window
+    ).start()
+    render_stage = Stage(
+        'render',
+        partial(render_stage_handler, page_upload_stage=page_upload_stage, metadata_stage=metadata_stage),
+        render_workers, render_workers * 2
+    ).start()
+    download_stage = Stage(
+        'download',
+        partial(download_stage_handler, render_stage=render_stage),
+        message_workers, message_workers
+    ).start()
+
+    idle = IdleTimer()
+    try:
+        while not shutdown_requested.is_set():
+            free_slots = min(concurrency_limit() - download_stage.pending(), download_stage.free_slots())
+            if free_slots <= 0:
+                time.sleep(1)
+                continue
+
+            messages = receive_messages(min(10, free_slots))
+            idle.received(messages)
+            if not messages:
+                if idle.expired():
+                    logger.info("No messages in queue")
+                    break
+                continue
+
+            for record in messages:
+                download_stage.put(record)
     except Exception as e:
-        logger.error(f"Error updating metadata for PDF {key}: {e}", exc_info=True)
+        logger.error(f"Error receiving messages: {e}", exc_info=True)
+
+    for stage in (download_stage, render_stage, page_upload_stage, metadata_stage):
+        stage.close()
+
+
+def request_shutdown(signum, frame):
+    logger.info(f"Received signal {signum}, finishing in-flight messages")
+    shutdown_requested.set()
+
+
+def run_worker():
+    """Consumes the queue in this process until it is empty or a shutdown is requested."""
+    signal.signal(signal.SIGTERM, request_shutdown)
+    signal.signal(signal.SIGINT, request_shutdown)
+
+    heartbeat.start()
+    try:
+        if processing_mode == 'pipeline':
+            run_pipeline()
+        else:
+            list_of_s3s = process_messages()
+            if list_of_s3s:
+                png_process(list_of_s3s)
+    finally:
+        heartbeat.stop()
+        page_uploader.shutdown()
+        if page_renderer is not None:
+            page_renderer.shutdown()
 
 
 if __name__ == "__main__":
-    list_of_s3s = process_messages()
-    if list_of_s3s:
-        png_process(list_of_s3s)
+    parser = argparse.ArgumentParser(description="Download queued PDFs and render their pages.")
+    parser.add_argument(
+        '--workers', type=int, default=int(os.getenv('WORKERS', 0)) or os.cpu_count() or 1,
+        help="Number of worker processes consuming the queue (default: WORKERS or the CPU count)"
+    )
+    args = parser.parse_args()
+
+    if args.workers > 1:
+        # Each worker runs its own receive loop on the shared queue
+        if not Supervisor(run_worker, args.workers).run():
+            raise SystemExit(1)
+    else:
+        run_worker()
@@ -7,7 +7,11 @@ echo "PROFILE : $PROFILE"
 echo "BUCKET_NAME : $BUCKET_NAME"
 echo "QUEUE_URL : $QUEUE_URL"
 echo "DYNAMODB_TABLE : $DYNAMODB_TABLE"
-CONTAINER_CMD='["python3", "./batch_processor.py"]'
+echo "CONTENT_INDEX_TABLE : $CONTENT_INDEX_TABLE"
+echo "NEGATIVE_CACHE_TABLE : $NEGATIVE_CACHE_TABLE"
+echo "FETCH_LEASE_TABLE : $FETCH_LEASE_TABLE"
+echo "STATE_MACHINE_ARN : $STATE_MACHINE_ARN"
+CONTAINER_CMD='["python3", "./batch_processor.py", "--workers", "2"]'  # one worker process per vCPU
 
 echo "" # Function to check if a required variable is set
 check_variable() {
@@ -105,6 +109,7 @@ cat <<EOF > TaskExecutionRolePolicy.json
             "Effect": "Allow",
             "Action": [
                 "s3:PutObject",
+                "s3:AbortMultipartUpload",
                 "s3:GetObject",
                 "s3:ListBucket"
             ],
@@ -118,6 +123,7 @@ cat <<EOF > TaskExecutionRolePolicy.json
             "Action": [
                 "sqs:ReceiveMessage",
                 "sqs:DeleteMessage",
+                "sqs:ChangeMessageVisibility",
                 "sqs:GetQueueAttributes"
             ],
             "Resource": [
@@ -129,10 +135,23 @@ cat <<EOF > TaskExecutionRolePolicy.json
             "Action": [
                 "dynamodb:PutItem",
                 "dynamodb:UpdateItem",
-                "dynamodb:GetItem"
+                "dynamodb:GetItem",
+                "dynamodb:DeleteItem"
             ],
             "Resource": [
-                "arn:aws:dynamodb:${REGION}:${ACCOUNT_ID}:table/${DYNAMODB_TABLE}"
+                "arn:aws:dynamodb:${REGION}:${ACCOUNT_ID}:table/${DYNAMODB_TABLE}",
+                "arn:aws:dynamodb:${REGION}:${ACCOUNT_ID}:table/${CONTENT_INDEX_TABLE}",
+                "arn:aws:dynamodb:${REGION}:${ACCOUNT_ID}:table/${NEGATIVE_CACHE_TABLE}",
+                "arn:aws:dynamodb:${REGION}:${ACCOUNT_ID}:table/${FETCH_LEASE_TABLE}"
+            ]
+        },
+        {
+            "Effect": "Allow",
+            "Action": [
+                "states:StartExecution"
+            ],
+            "Resource": [
+                "arn:aws:states:${REGION}:${ACCOUNT_ID}:stateMachine:*"
             ]
         }
     ]
@@ -229,6 +248,26 @@ cat <<EOF > job-definition.json
             {
                 "name": "DYNAMODB_TABLE",
                 "value": "${DYNAMODB_TABLE}"
+            },
+            {
+                "name": "CONTENT_INDEX_TABLE",
+                "value": "${CONTENT_INDEX_TABLE}"
+            },
+            {
+                "name": "NEGATIVE_CACHE_TABLE",
+                "value": "${NEGATIVE_CACHE_TABLE}"
+            },
+            {
+                "name": "FETCH_LEASE_TABLE",
+                "value": "${FETCH_LEASE_TABLE}"
+            },
+            {
+                "name": "STATE_MACHINE_ARN",
+                "value": "${STATE_MACHINE_ARN}"
+            },
+            {
+                "name": "RENDER_PROFILE",
+                "value": "vision"
             }
         ]
     }
@@ -11,6 +11,10 @@ echo "PROFILE : $PROFILE"
 echo "BUCKET_NAME : $BUCKET_NAME"
 echo "QUEUE_URL : $QUEUE_URL"
 echo "DYNAMODB_TABLE : $DYNAMODB_TABLE"
+echo "CONTENT_INDEX_TABLE : $CONTENT_INDEX_TABLE"
+echo "NEGATIVE_CACHE_TABLE : $NEGATIVE_CACHE_TABLE"
+echo "FETCH_LEASE_TABLE : $FETCH_LEASE_TABLE"
+echo "STATE_MACHINE_ARN : $STATE_MACHINE_ARN"
 echo "COMPUTE_ENV_NAME : $COMPUTE_ENV_NAME"
 
 CONTAINER_CMD='["python3", "./batch_processor.py"]'
@@ -112,6 +116,7 @@ cat <<EOF > TaskExecutionRolePolicy.json
             "Effect": "Allow",
             "Action": [
                 "s3:PutObject",
+                "s3:AbortMultipartUpload",
                 "s3:GetObject",
                 "s3:ListBucket"
             ],
@@ -125,6 +130,7 @@ cat <<EOF > TaskExecutionRolePolicy.json
             "Action": [
                 "sqs:ReceiveMessage",
                 "sqs:DeleteMessage",
+                "sqs:ChangeMessageVisibility",
                 "sqs:GetQueueAttributes"
             ],
             "Resource": [
@@ -136,10 +142,23 @@ cat <<EOF > TaskExecutionRolePolicy.json
             "Action": [
                 "dynamodb:PutItem",
                 "dynamodb:UpdateItem",
-                "dynamodb:GetItem"
+                "dynamodb:GetItem",
+                "dynamodb:DeleteItem"
             ],
             "Resource": [
-                "arn:aws:dynamodb:${REGION}:${ACCOUNT_ID}:table/${DYNAMODB_TABLE}"
+                "arn:aws:dynamodb:${REGION}:${ACCOUNT_ID}:table/${DYNAMODB_TABLE}",
+                "arn:aws:dynamodb:${REGION}:${ACCOUNT_ID}:table/${CONTENT_INDEX_TABLE}",
+                "arn:aws:dynamodb:${REGION}:${ACCOUNT_ID}:table/${NEGATIVE_CACHE_TABLE}",
+                "arn:aws:dynamodb:${REGION}:${ACCOUNT_ID}:table/${FETCH_LEASE_TABLE}"
+            ]
+        },
+        {
+            "Effect": "Allow",
+            "Action": [
+                "states:StartExecution"
+            ],
+            "Resource": [
+                "arn:aws:states:${REGION}:${ACCOUNT_ID}:stateMachine:*"
             ]
         },
         {
@@ -357,8 +376,21 @@ fi
 
 # Submit the job if required
 if [ "$SUBMIT_JOB" = true ]; then
+    # job-definition-fargate.json predates these settings, so they are passed as overrides.
+    # The pages go to aws/png2txt, which sends them to the model at low detail (RENDER_PROFILE=vision)
     aws batch submit-job --job-name $BATCH_JOB_NAME --job-queue $JOB_QUEUE \
-        --job-definition ${BATCH_JOB_NAME} --region $REGION --profile $PROFILE
+        --job-definition ${BATCH_JOB_NAME} --container-overrides "$(cat <<EOF
+{
+    "environment": [
+        {"name": "RENDER_PROFILE", "value": "vision"},
+        {"name": "CONTENT_INDEX_TABLE", "value": "${CONTENT_INDEX_TABLE}"},
+        {"name": "NEGATIVE_CACHE_TABLE", "value": "${NEGATIVE_CACHE_TABLE}"},
+        {"name": "FETCH_LEASE_TABLE", "value": "${FETCH_LEASE_TABLE}"},
+        {"name": "STATE_MACHINE_ARN", "value": "${STATE_MACHINE_ARN}"}
+    ]
+}
+EOF
+)" --region $REGION --profile $PROFILE
 fi
 
 # Clean up temporary files
@@ -0,0 +1,73 @@
+# content_index.py
+import logging
+from datetime import datetime
+from botocore.exceptions import ClientError
+
+# Configure logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+
+class ContentIndex:
+    """
+    DynamoDB index from a PDF's SHA-256 to the S3 key of the first copy stored.
+
+    The table is keyed on `content_sha256` (S). A claim is a conditional put, so
+    when several URLs resolve to the same bytes exactly one of them stores the
+    object and the rest point at it. Keys are per URL, so when a URL's content
+    changes the claim for its new bytes releases the entry for the old ones, which
+    would otherwise point other URLs at an object about to be overwritten.
+    """
+
+    def __init__(self, dynamodb_client, table_name):
+        self.dynamodb = dynamodb_client
+        self.table_name = table_name
+
+    def claim(self, content_sha256, s3_key, file_size, previous_sha256=None):
+        """
+        Registers s3_key as the stored copy of this content.
+
+        previous_sha256 is the hash of the content s3_key held before; once the claim
+        succeeds its entry is released, since the object is about to be overwritten.
+
+        Returns:
+        - None if the claim succeeded, otherwise the S3 key already registered for the hash.
+        """
+        try:
+            self.dynamodb.put_item(
+                TableName=self.table_name,
+                Item={
+                    'content_sha256': {'S': content_sha256},
+                    's3_key': {'S': s3_key},
+                    'file_size': {'N': str(file_size)},
+                    'created_timestamp': {'S': datetime.utcnow().isoformat()}
+                },
+                ConditionExpression='attribute_not_exists(content_sha256)'
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+        else:
+            if previous_sha256 and previous_sha256 != content_sha256:
+                self.release(previous_sha256, s3_key)
+            return None
+
+        response = self.dynamodb.get_item(
+            TableName=self.table_name,
+            Key={'content_sha256': {'S': content_sha256}},
+            ConsistentRead=True
+        )
+        return response['Item']['s3_key']['S']
+
+    def release(self, content_sha256, s3_key):
+        """Removes a claim made by s3_key, e.g. when its upload failed after claiming."""
+        try:
+            self.dynamodb.delete_item(
+                TableName=self.table_name,
+                Key={'content_sha256': {'S': content_sha256}},
+                ConditionExpression='s3_key = :s3_key',
+                ExpressionAttributeValues={':s3_key': {'S': s3_key}}
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                logger.error(f"Failed to release content hash {content_sha256} for {s3_key}: {e}")
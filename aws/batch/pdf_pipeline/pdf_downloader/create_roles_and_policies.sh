@@ -7,6 +7,10 @@ echo "PROFILE : $PROFILE"
 echo "BUCKET_NAME : $BUCKET_NAME"
 echo "QUEUE_URL : $QUEUE_URL"
 echo "DYNAMODB_TABLE : $DYNAMODB_TABLE"
+echo "CONTENT_INDEX_TABLE : $CONTENT_INDEX_TABLE"
+echo "NEGATIVE_CACHE_TABLE : $NEGATIVE_CACHE_TABLE"
+echo "FETCH_LEASE_TABLE : $FETCH_LEASE_TABLE"
+echo "STATE_MACHINE_ARN : $STATE_MACHINE_ARN"
 ECS_ROLE_ARN=$(aws iam list-roles \
     --query "Roles[?contains(RoleName, 'EcsService') && contains(RoleName, 'prod')].Arn | [0]" \
     --output text --region $REGION --profile $PROFILE)
@@ -85,6 +89,7 @@ cat <<EOF > TaskExecutionRolePolicy.json
             "Effect": "Allow",
             "Action": [
                 "s3:PutObject",
+                "s3:AbortMultipartUpload",
                 "s3:GetObject",
                 "s3:ListBucket"
             ],
@@ -98,6 +103,7 @@ cat <<EOF > TaskExecutionRolePolicy.json
             "Action": [
                 "sqs:ReceiveMessage",
                 "sqs:DeleteMessage",
+                "sqs:ChangeMessageVisibility",
                 "sqs:GetQueueAttributes"
             ],
             "Resource": [
@@ -109,10 +115,23 @@ cat <<EOF > TaskExecutionRolePolicy.json
             "Action": [
                 "dynamodb:PutItem",
                 "dynamodb:UpdateItem",
-                "dynamodb:GetItem"
+                "dynamodb:GetItem",
+                "dynamodb:DeleteItem"
             ],
             "Resource": [
-                "arn:aws:dynamodb:${REGION}:${ACCOUNT_ID}:table/${DYNAMODB_TABLE}"
+                "arn:aws:dynamodb:${REGION}:${ACCOUNT_ID}:table/${DYNAMODB_TABLE}",
+                "arn:aws:dynamodb:${REGION}:${ACCOUNT_ID}:table/${CONTENT_INDEX_TABLE}",
+                "arn:aws:dynamodb:${REGION}:${ACCOUNT_ID}:table/${NEGATIVE_CACHE_TABLE}",
+                "arn:aws:dynamodb:${REGION}:${ACCOUNT_ID}:table/${FETCH_LEASE_TABLE}"
+            ]
+        },
+        {
+            "Effect": "Allow",
+            "Action": [
+                "states:StartExecution"
+            ],
+            "Resource": [
+                "arn:aws:states:${REGION}:${ACCOUNT_ID}:stateMachine:*"
             ]
         }
     ]
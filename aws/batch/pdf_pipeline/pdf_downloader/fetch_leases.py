@@ -0,0 +1,70 @@
+# fetch_leases.py
+import logging
+import time
+from contextlib import contextmanager
+from botocore.exceptions import ClientError
+
+# Configure logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+
+class FetchLeases:
+    """
+    Single-flight leases that let one worker at a time fetch a given URL.
+
+    The table is keyed on `url` (S). A lease is a conditional put that succeeds when
+    there is no lease, the lease has expired (`expires_at`, also the table's TTL
+    attribute), or the lease belongs to the same SQS message, so a redelivery of a
+    message whose worker died takes its lease over instead of being dropped. Workers
+    that lose the race can ack their message: the holder's message stays on the
+    queue until the fetch succeeds, and its result is recorded under the same URL.
+    """
+
+    def __init__(self, dynamodb_client, table_name, lease_seconds):
+        self.dynamodb = dynamodb_client
+        self.table_name = table_name
+        self.lease_seconds = lease_seconds
+
+    def acquire(self, cleaned_url, message_id):
+        """Returns True if this message now holds the lease on the URL."""
+        now = int(time.time())
+        try:
+            self.dynamodb.put_item(
+                TableName=self.table_name,
+                Item={
+                    'url': {'S': cleaned_url},
+                    'message_id': {'S': message_id},
+                    'expires_at': {'N': str(now + self.lease_seconds)}
+                },
+                ConditionExpression='attribute_not_exists(#url) OR expires_at < :now OR message_id = :message_id',
+                ExpressionAttributeNames={'#url': 'url'},
+                ExpressionAttributeValues={':now': {'N': str(now)}, ':message_id': {'S': message_id}}
+            )
+            return True
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+            return False
+
+    def release(self, cleaned_url, message_id):
+        try:
+            self.dynamodb.delete_item(
+                TableName=self.table_name,
+                Key={'url': {'S': cleaned_url}},
+                ConditionExpression='message_id = :message_id',
+                ExpressionAttributeValues={':message_id': {'S': message_id}}
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                logger.error(f"Failed to release fetch lease on {cleaned_url}: {e}")
+
+    @contextmanager
+    def hold(self, cleaned_url, message_id):
+        """Yields whether the lease was acquired, releasing it on exit if it was."""
+        acquired = self.acquire(cleaned_url, message_id)
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                self.release(cleaned_url, message_id)
@@ -0,0 +1,76 @@
+# heartbeat.py
+import logging
+import threading
+
+# Configure logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+
+class VisibilityHeartbeat:
+    """
+    Keeps received SQS messages invisible for as long as their work runs.
+
+    Receipt handles are tracked from the moment a message is received until its
+    work finishes. Every `interval` seconds a background thread resets the
+    visibility timeout of all tracked handles, 10 per ChangeMessageVisibilityBatch
+    call, so a slow download is not redelivered to another worker halfway through.
+    """
+
+    def __init__(self, sqs_client, queue_url, visibility_timeout, interval=None):
+        self.sqs = sqs_client
+        self.queue_url = queue_url
+        self.visibility_timeout = visibility_timeout
+        self.interval = interval or max(visibility_timeout / 3, 1)
+        self._handles = set()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def track(self, receipt_handle):
+        with self._lock:
+            self._handles.add(receipt_handle)
+
+    def untrack(self, receipt_handle):
+        with self._lock:
+            self._handles.discard(receipt_handle)
+
+    def start(self):
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name='visibility-heartbeat', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.extend()
+            except Exception as e:
+                logger.error(f"Error extending message visibility: {e}", exc_info=True)
+
+    def extend(self):
+        with self._lock:
+            handles = list(self._handles)
+
+        for start in range(0, len(handles), 10):
+            batch = handles[start:start + 10]
+            response = self.sqs.change_message_visibility_batch(
+                QueueUrl=self.queue_url,
+                Entries=[
+                    {'Id': str(i), 'ReceiptHandle': handle, 'VisibilityTimeout': self.visibility_timeout}
+                    for i, handle in enumerate(batch)
+                ]
+            )
+            for failure in response.get('Failed', []):
+                # The message was already deleted or its handle expired, so stop extending it
+                logger.warning(f"Could not extend visibility of a message: {failure.get('Message')}")
+                self.untrack(batch[int(failure['Id'])])
+
+        if handles:
+            logger.info(f"Extended visibility of {len(handles)} in-flight messages")
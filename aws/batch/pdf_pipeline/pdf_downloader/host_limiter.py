@@ -0,0 +1,135 @@
+# host_limiter.py
+import json
+import logging
+import threading
+import time
+
+# Configure logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+
+class HostUnavailable(Exception):
+    """Raised instead of sending a request to a host whose circuit is open."""
+
+    def __init__(self, host, retry_after):
+        super().__init__(f"Host {host} is unavailable for another {retry_after:.0f}s")
+        self.host = host
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Allows `rate` requests per second on average, with bursts of up to `burst`. A rate of 0 is unlimited."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Takes a token, sleeping until one is available. Waiting callers are served in order."""
+        if self.rate <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+        if wait > 0:
+            time.sleep(wait)
+
+
+class CircuitBreaker:
+    """
+    Stops requests to a host after `failure_threshold` consecutive failures.
+
+    The circuit stays open for `cooldown` seconds. After that, requests go through
+    again; one success closes the circuit, one more failure reopens it.
+    """
+
+    def __init__(self, host, failure_threshold, cooldown):
+        self.host = host
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self._failures = 0
+        self._open_until = 0
+        self._lock = threading.Lock()
+
+    def check(self):
+        with self._lock:
+            remaining = self._open_until - time.monotonic()
+        if remaining > 0:
+            raise HostUnavailable(self.host, remaining)
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._failures >= self.failure_threshold:
+                self._open_until = time.monotonic() + self.cooldown
+                logger.warning(f"Circuit opened for {self.host} after {self._failures} failures, "
+                               f"pausing requests for {self.cooldown}s")
+
+
+class HostLimiter:
+    """
+    Per-host politeness limits shared by every thread in the process.
+
+    Each host gets a TokenBucket and a CircuitBreaker, created on first use. Hosts use
+    the default rate, burst, failure threshold and cooldown unless `overrides` maps
+    the host name to a dict overriding any of them.
+    """
+
+    def __init__(self, rate, burst, failure_threshold, cooldown, overrides=None):
+        self.defaults = {'rate': rate, 'burst': burst, 'failure_threshold': failure_threshold, 'cooldown': cooldown}
+        self.overrides = overrides or {}
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, environ):
+        """
+        Builds a limiter from HOST_RATE_LIMIT (requests/s), HOST_BURST, CIRCUIT_FAILURE_THRESHOLD,
+        CIRCUIT_COOLDOWN_SECONDS and HOST_LIMITS, a JSON object of per-host overrides, e.g.
+        {"docs.aws.amazon.com": {"rate": 1, "burst": 2}}.
+        """
+        return cls(
+            rate=float(environ.get('HOST_RATE_LIMIT', 2)),
+            burst=float(environ.get('HOST_BURST', 4)),
+            failure_threshold=int(environ.get('CIRCUIT_FAILURE_THRESHOLD', 5)),
+            cooldown=float(environ.get('CIRCUIT_COOLDOWN_SECONDS', 300)),
+            overrides=json.loads(environ.get('HOST_LIMITS') or '{}')
+        )
+
+    def _host(self, host):
+        with self._lock:
+            if host not in self._hosts:
+                settings = dict(self.defaults, **self.overrides.get(host, {}))
+                self._hosts[host] = (
+                    TokenBucket(settings['rate'], settings['burst']),
+                    CircuitBreaker(host, settings['failure_threshold'], settings['cooldown'])
+                )
+            return self._hosts[host]
+
+    def acquire(self, host, rate_limited=True):
+        """
+        Waits for the host's rate limit, unless `rate_limited` is False. Raises HostUnavailable
+        if its circuit is open.
+        """
+        bucket, breaker = self._host(host)
+        breaker.check()
+        if rate_limited:
+            bucket.acquire()
+
+    def record(self, host, ok):
+        _, breaker = self._host(host)
+        if ok:
+            breaker.record_success()
+        else:
+            breaker.record_failure()
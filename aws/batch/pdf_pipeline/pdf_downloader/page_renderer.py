@@ -0,0 +1,123 @@
+# page_renderer.py
+import logging
+import multiprocessing
+import tempfile
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from io import BytesIO
+import fitz  # PyMuPDF
+from PIL import Image
+from page_encoder import encode_image
+
+# Configure logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+
+def render_page(pdf_document, page_index, profile):
+    """Renders one page straight at the size of a RenderProfile and returns it in the profile's encoding."""
+    page = pdf_document.load_page(page_index)
+    zoom = profile.zoom(page.rect.width, page.rect.height)
+    pix = page.get_pixmap(
+        matrix=fitz.Matrix(zoom, zoom),
+        colorspace=fitz.csRGB if profile.colorspace == 'rgb' else fitz.csGRAY,
+        alpha=False
+    )
+    if profile.image_format == 'png' and profile.colorspace != 'bilevel' and profile.compress_level is None:
+        # fitz encodes plain PNGs itself, without copying the pixels into Pillow
+        return pix.tobytes(output="png")
+
+    image = Image.frombytes('RGB' if pix.n == 3 else 'L', (pix.width, pix.height), pix.samples)
+    output = BytesIO()
+    encode_image(image, profile, output)
+    return output.getvalue()
+
+
+def _render_range(path, start, stop, profile):
+    """Runs in a pool process: renders pages [start, stop) of the PDF at `path`."""
+    pdf_document = fitz.open(path, filetype="pdf")
+    try:
+        return [render_page(pdf_document, i, profile) for i in range(start, stop)]
+    finally:
+        pdf_document.close()
+
+
+@contextmanager
+def pdf_path(pdf_buffer):
+    """
+    Yields a path to the PDF held in a SpillBuffer: its spill file, or a temp copy of an
+    in-memory buffer, so that other processes can open it.
+    """
+    if pdf_buffer.spilled:
+        pdf_buffer.flush()
+        yield pdf_buffer.name
+        return
+
+    with tempfile.NamedTemporaryFile(suffix='.pdf') as pdf_file:
+        with pdf_buffer.view() as contents:
+            pdf_file.write(contents)
+        pdf_file.flush()
+        yield pdf_file.name
+
+
+def count_pages(path):
+    pdf_document = fitz.open(path, filetype="pdf")
+    try:
+        return len(pdf_document)
+    finally:
+        pdf_document.close()
+
+
+class PageRenderer:
+    """
+    Renders the pages of a PDF on several cores with a pool of processes.
+
+    Pages are split into ranges of `pages_per_task` pages. Each pool process opens
+    the PDF from its file, so only page numbers and PNG bytes cross process
+    boundaries. At most two ranges per process are in flight, and results are
+    yielded in page order as they arrive, so a slow consumer (the page uploads)
+    stops new ranges from being submitted. The pool is started on first use with
+    the 'spawn' method and shared by all threads of the process.
+    """
+
+    def __init__(self, processes, pages_per_task=8):
+        self.processes = processes
+        self.pages_per_task = pages_per_task
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.processes,
+                    mp_context=multiprocessing.get_context('spawn')
+                )
+                logger.info(f"Started page render pool with {self.processes} processes")
+            return self._executor
+
+    def render(self, path, page_count, profile):
+        """Yields every page of the PDF at `path` rendered and encoded with `profile`, in page order."""
+        executor = self._pool()
+        ranges = deque(
+            (start, min(start + self.pages_per_task, page_count))
+            for start in range(0, page_count, self.pages_per_task)
+        )
+        in_flight = deque()
+        try:
+            while ranges or in_flight:
+                while ranges and len(in_flight) < self.processes * 2:
+                    in_flight.append(executor.submit(_render_range, path, *ranges.popleft(), profile))
+                yield from in_flight.popleft().result()
+        finally:
+            # Stop rendering ranges nobody will read if the consumer gave up early
+            for future in in_flight:
+                future.cancel()
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True, cancel_futures=True)
+                self._executor = None
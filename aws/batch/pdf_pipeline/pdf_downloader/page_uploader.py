@@ -0,0 +1,121 @@
+# page_uploader.py
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+# Configure logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+
+def upload_page(s3_client, bucket, key, body):
+    """Uploads a page from the start of a seekable file object, so a failed attempt can be repeated."""
+    body.seek(0)
+    s3_client.upload_fileobj(body, bucket, key)
+
+
+def retry_failed_pages(s3_client, bucket, manifest, failed, rounds):
+    """
+    Retries the uploads collected in `failed` (page number -> (key, body, size)) up to
+    `rounds` more times with backoff, recording each one that succeeds in the manifest.
+    Pages that still fail are left out of the manifest. Every body is closed.
+    """
+    for attempt in range(rounds):
+        if not failed:
+            break
+        time.sleep(min(0.5 * 2 ** attempt, 8))
+        for page_number, (key, body, size) in list(failed.items()):
+            try:
+                upload_page(s3_client, bucket, key, body)
+            except Exception as e:
+                logger.warning(f"Retry {attempt + 1} of page {page_number} to s3://{bucket}/{key} failed: {e}")
+                continue
+            del failed[page_number]
+            body.close()
+            manifest.page_done(page_number, size)
+
+    for page_number, (key, body, _) in failed.items():
+        logger.error(f"Giving up on page {page_number} to s3://{bucket}/{key}")
+        body.close()
+    failed.clear()
+
+
+class PageUploader:
+    """
+    Uploads rendered pages to S3 on a pool of threads, so the next page renders while
+    the previous ones are in flight.
+
+    At most `window` pages are queued or uploading at once, across every document;
+    `PageUploads.put` only blocks the renderer while the window is full, which also
+    bounds the page images held in memory. Pages whose upload fails are collected and
+    retried once the document's other pages are in, up to `max_attempts` attempts in all.
+    """
+
+    def __init__(self, s3_client, workers=8, window=16, max_attempts=3):
+        self.s3 = s3_client
+        self.max_attempts = max_attempts
+        self._slots = threading.BoundedSemaphore(max(window, 1))
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='page-upload')
+
+    def start(self, bucket, manifest):
+        """Starts the uploads of one PDF's pages, recorded in its PageManifest."""
+        return PageUploads(self, bucket, manifest)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+
+class PageUploads:
+    """
+    The page uploads of one PDF. Use it as a context manager and call `finish` once
+    every page is put; leaving the block waits for the uploads still in flight.
+    """
+
+    def __init__(self, uploader, bucket, manifest):
+        self.uploader = uploader
+        self.bucket = bucket
+        self.manifest = manifest
+        self.failed = {}
+        self._futures = []
+        self._lock = threading.Lock()
+
+    def put(self, page_number, key, body, size):
+        """Queues the upload of one page from `body`, which is closed once it is uploaded."""
+        self.uploader._slots.acquire()
+        try:
+            self._futures.append(self.uploader._executor.submit(self._upload, page_number, key, body, size))
+        except Exception:
+            self.uploader._slots.release()
+            body.close()
+            raise
+
+    def _upload(self, page_number, key, body, size):
+        try:
+            upload_page(self.uploader.s3, self.bucket, key, body)
+        except Exception as e:
+            logger.warning(f"Upload of page {page_number} to s3://{self.bucket}/{key} failed, will retry: {e}")
+            with self._lock:
+                self.failed[page_number] = (key, body, size)
+            return
+        finally:
+            self.uploader._slots.release()
+        body.close()
+        self.manifest.page_done(page_number, size)
+
+    def finish(self):
+        """Waits for the queued uploads, retries the pages that failed and returns the manifest."""
+        wait(self._futures)
+        self._futures = []
+        retry_failed_pages(self.uploader.s3, self.bucket, self.manifest, self.failed, self.uploader.max_attempts - 1)
+        return self.manifest
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        wait(self._futures)
+        self._futures = []
+        for _, body, _ in self.failed.values():
+            body.close()
+        self.failed.clear()
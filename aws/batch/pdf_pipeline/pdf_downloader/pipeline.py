@@ -0,0 +1,71 @@
+# pipeline.py
+import logging
+import queue
+import threading
+
+# Configure logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+_STOP = object()
+
+
+class Stage:
+    """
+    A pool of worker threads fed from a bounded queue.
+
+    Each item put on the stage is passed to `handler` by one of the workers. Handlers
+    hand their output to the next stage with its `put`, which blocks while that
+    stage's queue is full, so a slow stage applies backpressure to the ones before it.
+    Handler errors are logged and do not stop the worker.
+    """
+
+    def __init__(self, name, handler, workers, queue_size):
+        self.name = name
+        self.handler = handler
+        self.queue = queue.Queue(maxsize=queue_size)
+        self._pending = 0
+        self._pending_lock = threading.Lock()
+        self._threads = [
+            threading.Thread(target=self._run, name=f"{name}-{i}", daemon=True)
+            for i in range(workers)
+        ]
+
+    def start(self):
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def put(self, item):
+        with self._pending_lock:
+            self._pending += 1
+        self.queue.put(item)
+
+    def free_slots(self):
+        return max(self.queue.maxsize - self.queue.qsize(), 0)
+
+    def pending(self):
+        """Number of items put on the stage that its workers have not finished yet."""
+        with self._pending_lock:
+            return self._pending
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is _STOP:
+                return
+            try:
+                self.handler(item)
+            except Exception as e:
+                logger.error(f"Error in {self.name} stage: {e}", exc_info=True)
+            finally:
+                with self._pending_lock:
+                    self._pending -= 1
+
+    def close(self):
+        """Lets the workers finish everything already queued, then stops them."""
+        for _ in self._threads:
+            self.queue.put(_STOP)
+        for thread in self._threads:
+            thread.join()
+        logger.info(f"Pipeline stage {self.name} finished")
@@ -7,10 +7,11 @@ import re
 from datetime import datetime
 from io import BytesIO
 from pdf2image import convert_from_bytes
-import requests
-from requests.adapters import HTTPAdapter
-from requests.packages.urllib3.util.retry import Retry
-from urllib.parse import urlparse, urlunparse, unquote
+from urllib.parse import urlparse, unquote
+from pdf_downloader import clean_url, transfer_pdf_to_s3
+from page_manifest import PageManifest, page_prefix
+from page_renderer import render_page
+from render_profile import render_profile
 import fitz  # PyMuPDF
 
 
@@ -29,63 +30,14 @@ queue_url = os.getenv('QUEUE_URL')
 dynamodb_table = os.getenv('DYNAMODB_TABLE')
 state_machine_arn = os.getenv('STATE_MACHINE_ARN')
 
+# Size, colorspace and encoding of the page images, picked by RENDER_PROFILE for the consumer of the pages
+page_profile = render_profile()
+
 # Check for required environment variables
 if not all([bucket_name, queue_url, dynamodb_table]):
     logger.error("One or more required environment variables are missing.")
     raise ValueError("Missing required environment variables.")
 
-# Setup requests session with retries
-session = requests.Session()
-retry = Retry(
-    total=5,
-    backoff_factor=0.3,
-    status_forcelist=(500, 502, 504),
-)
-adapter = HTTPAdapter(max_retries=retry)
-session.mount('http://', adapter)
-session.mount('https://', adapter)
-
-
-def is_valid_pdf(content):
-    return content.startswith(b'%PDF')
-
-
-def clean_url(pdf_url):
-    parsed_url = urlparse(pdf_url)
-    cleaned_url = urlunparse(parsed_url._replace(query='', fragment=''))
-    return cleaned_url
-
-
-def download_pdf(cleaned_url):
-    try:
-        if not re.match(r'^https?://.*\.pdf$', cleaned_url, re.IGNORECASE):
-            logger.info(f"Not a PDF URL: {cleaned_url}")
-            return None
-
-        headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3'}
-        response = session.get(cleaned_url, headers=headers, stream=True)
-        response.raise_for_status()
-
-        pdf_data = BytesIO()
-        for chunk in response.iter_content(chunk_size=1024):
-            pdf_data.write(chunk)
-        pdf_data.seek(0)
-
-        if not is_valid_pdf(pdf_data.read(4)):
-            logger.error(f"Downloaded content is not a valid PDF: {cleaned_url}")
-            return None
-
-        pdf_data.seek(0)
-        return pdf_data
-
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Failed to download PDF: {cleaned_url}, error: {e}")
-        return None
-    except ValueError as e:
-        logger.error(f"Invalid PDF content from URL: {cleaned_url}, error: {e}")
-        return None
-
-
 def process_messages():
     list_of_s3s = []
     try:
@@ -108,15 +60,14 @@ def process_messages():
                 cleaned_url = clean_url(message_body)
                 if re.match(r'^https?://.*\.pdf$', cleaned_url, re.IGNORECASE):
                     try:
-                        pdf_data = download_pdf(cleaned_url)
-                        if pdf_data:
-                            parsed_url = urlparse(cleaned_url)
-                            hostname = parsed_url.netloc.replace('.', '_')
-                            base_name = os.path.basename(unquote(parsed_url.path)).replace('.pdf', '')
-                            object_name = f"{hostname}/{base_name}/{base_name}.pdf"
-
-                            # Upload PDF to S3
-                            s3.upload_fileobj(pdf_data, bucket_name, object_name)
+                        parsed_url = urlparse(cleaned_url)
+                        hostname = parsed_url.netloc.replace('.', '_')
+                        base_name = os.path.basename(unquote(parsed_url.path)).replace('.pdf', '')
+                        object_name = f"{hostname}/{base_name}/{base_name}.pdf"
+
+                        # Download the PDF and upload it to S3
+                        result = transfer_pdf_to_s3(cleaned_url, s3, bucket_name, object_name)
+                        if result is not None:
                             logger.info(f"PDF saved to S3: s3://{bucket_name}/{object_name}")
 
                             list_of_s3s.append(object_name)
@@ -126,8 +77,7 @@ def process_messages():
 
                             # Save metadata to DynamoDB
                             current_time = datetime.utcnow().isoformat()
-                            response = s3.head_object(Bucket=bucket_name, Key=object_name)
-                            file_size = response['ContentLength']
+                            file_size = result['file_size']
 
                             dynamodb.put_item(
                                 TableName=dynamodb_table,
@@ -183,17 +133,15 @@ def convert_pdf2pngs(pdf_content, bucket, key):
     pdf_document = fitz.open(stream=pdf_content, filetype="pdf")
     logger.info("PDF document opened")
 
-    metadata_entries = []
+    manifest = PageManifest.for_pdf(bucket, key, len(pdf_document), page_profile.page_template)
     for i in range(len(pdf_document)):
-        page = pdf_document.load_page(i)
-        pix = page.get_pixmap()
-        image_buffer = BytesIO(pix.tobytes(output="png"))
-        png_key = f"{key.rstrip('.pdf')}/page-{i + 1}.png"
+        png_data = render_page(pdf_document, i, page_profile)
+        png_key = page_prefix(key) + page_profile.page_template.format(n=i + 1)
 
         try:
             # Save each page as a PNG to S3
-            s3.upload_fileobj(image_buffer, bucket, png_key)
-            metadata_entries.append(f"s3://{bucket}/{png_key}")
+            s3.upload_fileobj(BytesIO(png_data), bucket, png_key)
+            manifest.page_done(i + 1, len(png_data))
             logger.info(f"Uploaded page {i + 1} to S3")
         except Exception as e:
             logger.error(f"Error uploading page {i + 1} for PDF {key}: {e}")
@@ -202,11 +150,11 @@ def convert_pdf2pngs(pdf_content, bucket, key):
     s3.put_object(
         Bucket=bucket,
         Key=key,
-        Body=json.dumps(metadata_entries)
+        Body=json.dumps(manifest.to_json())
     )
     logger.info(f"PNG files metadata saved to s3://{bucket_name}/{key}")
 
-    return metadata_entries
+    return manifest
 
 
 def process_pdf(bucket, key):
@@ -219,30 +167,30 @@ def process_pdf(bucket, key):
         logger.info("PDF downloaded from S3")
 
         # Convert PDF to images
-        metadata_entries = convert_pdf2pngs(pdf_content, bucket, key)
+        manifest = convert_pdf2pngs(pdf_content, bucket, key)
         logger.info("PDF conversion to PNG completed")
 
         # Update metadata
         current_time = datetime.utcnow().isoformat()
         metadata = {
-            "pages": metadata_entries,
+            "page_manifest": manifest,
             "pages_extracted_timestamp": current_time,
             "status": "PagesExtracted"
         }
 
         # Save metadata to DynamoDB
         save_metadata_to_dynamodb(key, metadata)
-        return metadata_entries
+        return manifest
     
     except Exception as e:
         logger.error(f"Error processing PDF {key}: {e}", exc_info=True)
 
 
-def trigger_step_functions(png_files):
+def trigger_step_functions(manifest):
     try:
         response = step_functions.start_execution(
             stateMachineArn=state_machine_arn,
-            input=json.dumps({'pngFiles': png_files})
+            input=json.dumps({'pageManifest': manifest.to_json()})
         )
         logger.info(f"Step Functions state machine triggered: {response['executionArn']}")
     except Exception as e:
@@ -254,12 +202,12 @@ def save_metadata_to_dynamodb(key, metadata):
         dynamodb.update_item(
             TableName=dynamodb_table,
             Key={'url': {'S': f"s3://{bucket_name}/{key}"}},
-            UpdateExpression="set pages = :pages, pages_extracted_timestamp = :pages_extracted_timestamp, #status = :status",
+            UpdateExpression="set page_manifest = :page_manifest, pages_extracted_timestamp = :pages_extracted_timestamp, #status = :status remove pages",
             ExpressionAttributeNames={
                 '#status': 'status'
             },
             ExpressionAttributeValues={
-                ':pages': {'L': [{'S': page} for page in metadata['pages']]},
+                ':page_manifest': metadata['page_manifest'].to_dynamodb(s3),
                 ':pages_extracted_timestamp': {'S': metadata['pages_extracted_timestamp']},
                 ':status': {'S': metadata['status']}
             }
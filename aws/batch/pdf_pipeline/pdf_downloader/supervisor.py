@@ -0,0 +1,114 @@
+# supervisor.py
+import logging
+import multiprocessing
+import signal
+import time
+from collections import deque
+
+# Configure logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+
+class Supervisor:
+    """
+    Runs `target` in `workers` separate processes so CPU-bound work uses every core.
+
+    Workers are started with the 'spawn' method, so each one imports the worker
+    module afresh and builds its own boto3 clients instead of sharing the parent's
+    connections. On SIGTERM or SIGINT the supervisor forwards SIGTERM to the workers,
+    which stop receiving and finish the messages they hold, and waits for them to
+    exit. A worker that dies with a non-zero exit code is replaced, unless the
+    supervisor is draining; one that exits cleanly (the queue is empty) is not.
+
+    Replacements back off exponentially, from `restart_backoff` up to
+    `max_restart_backoff` seconds, for a worker that keeps crashing; a worker that
+    ran for `healthy_after` seconds starts again from the shortest delay. At most
+    `max_restarts` replacements are made in any `restart_window` seconds. Past that,
+    crashed workers are not replaced, so a worker that cannot start (missing
+    environment, bad credentials) does not restart in a tight loop.
+    """
+
+    def __init__(self, target, workers, poll_interval=1, restart_backoff=1, max_restart_backoff=60,
+                 healthy_after=60, max_restarts=10, restart_window=300):
+        self.target = target
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.restart_backoff = restart_backoff
+        self.max_restart_backoff = max_restart_backoff
+        self.healthy_after = healthy_after
+        self.max_restarts = max_restarts
+        self.restart_window = restart_window
+        self._context = multiprocessing.get_context('spawn')
+        self._processes = []
+        self._started_at = []
+        self._crashes = [0] * workers
+        self._restart_at = {}
+        self._restarts = deque()
+        self._abandoned = set()
+        self._draining = False
+
+    def _start_worker(self, index):
+        process = self._context.Process(target=self.target, name=f"worker-{index}")
+        process.start()
+        logger.info(f"Started {process.name} (pid {process.pid})")
+        return process
+
+    def _worker_crashed(self, index, process, now):
+        """Schedules the replacement of a crashed worker, or abandons its slot."""
+        logger.error(f"{process.name} exited with code {process.exitcode}")
+        if self._draining:
+            self._abandoned.add(index)
+            return
+
+        while self._restarts and self._restarts[0] <= now - self.restart_window:
+            self._restarts.popleft()
+        if len(self._restarts) >= self.max_restarts:
+            logger.error(f"Not replacing {process.name}: {len(self._restarts)} workers were restarted "
+                         f"in the last {self.restart_window} seconds")
+            self._abandoned.add(index)
+            return
+
+        if now - self._started_at[index] >= self.healthy_after:
+            self._crashes[index] = 0
+        self._crashes[index] += 1
+        delay = min(self.restart_backoff * 2 ** (self._crashes[index] - 1), self.max_restart_backoff)
+        self._restart_at[index] = now + delay
+        self._restarts.append(now)
+        logger.info(f"Restarting {process.name} in {delay} seconds")
+
+    def _drain(self, signum, frame):
+        if self._draining:
+            return
+        self._draining = True
+        logger.info(f"Received signal {signum}, draining {len(self._processes)} workers")
+        for process in self._processes:
+            if process.is_alive():
+                process.terminate()
+
+    def run(self):
+        """Starts the workers and returns once all of them have exited."""
+        signal.signal(signal.SIGTERM, self._drain)
+        signal.signal(signal.SIGINT, self._drain)
+
+        self._processes = [self._start_worker(i) for i in range(self.workers)]
+        self._started_at = [time.monotonic()] * self.workers
+        while self._restart_at or any(process.is_alive() for process in self._processes):
+            time.sleep(self.poll_interval)
+            now = time.monotonic()
+            for i, process in enumerate(self._processes):
+                if i in self._restart_at:
+                    if self._draining:
+                        del self._restart_at[i]
+                        self._abandoned.add(i)
+                    elif now >= self._restart_at[i]:
+                        del self._restart_at[i]
+                        self._processes[i] = self._start_worker(i)
+                        self._started_at[i] = now
+                    continue
+                if i in self._abandoned or process.is_alive() or process.exitcode in (None, 0):
+                    continue
+                self._worker_crashed(i, process, now)
+
+        logger.info("All workers exited")
+        return all(process.exitcode == 0 for process in self._processes)
@@ -9,7 +9,7 @@ rm -rf lambda_package function.zip
 docker run --rm --platform=linux/arm64 --entrypoint bash -v $(pwd):/var/task -w /var/task amazon/aws-lambda-python:3.9.2024.05.20.23 -c "
     yum install -y zip &&
     pip install --platform manylinux2014_aarch64 --target=lambda_package/ --implementation cp --python-version 3.9 --only-binary=:all: --upgrade -r requirements.txt &&
-    cp lambda_function.py lambda_package/ &&
+    cp lambda_function.py page_manifest.py lambda_package/ &&
     cd lambda_package &&
     zip -r ../function.zip .
 "
@@ -18,7 +18,7 @@ docker run --rm --platform=linux/arm64 --entrypoint bash -v $(pwd):/var/task -w
 docker run --rm --platform=linux/arm64 --entrypoint bash -v $(pwd):/var/task -w /var/task amazon/aws-lambda-python:3.9.2024.05.20.23 -c "
     yum install -y zip unzip &&
     pip install --platform manylinux2014_aarch64 --target=lambda_package/ --implementation cp --python-version 3.9 --only-binary=:all: --upgrade -r requirements.txt &&
-    cp lambda_function.py lambda_package/ &&
+    cp lambda_function.py page_manifest.py lambda_package/ &&
     cd lambda_package &&
     zip -r ../function.zip . &&
     cd .. &&
@@ -6,6 +6,7 @@ import os
 import logging
 import boto3
 from openai import OpenAI
+from page_manifest import PageManifest
 
 
 # Set up logging
@@ -18,7 +19,10 @@ client = OpenAI()
 region_name = os.getenv('REGION', 'us-west-2')
 s3 = boto3.client('s3', region_name=region_name)
 
-def png2txt(base64_image, max_retries=5):
+# Page images are PNG unless the renderer's profile picked another encoding, shown by the key's extension
+IMAGE_CONTENT_TYPES = {'.png': 'image/png', '.jpg': 'image/jpeg', '.webp': 'image/webp'}
+
+def png2txt(base64_image, max_retries=5, content_type='image/png'):
     instruction = ("This image was created from a single page of a PDF document. "
                    "Extract the text from this image into a markdown format that "
                    "mimics the structure of the original PDF page in the image. "
@@ -37,7 +41,7 @@ def png2txt(base64_image, max_retries=5):
                             {
                                 "type": "image_url",
                                 "image_url": {
-                                    "url": f"data:image/png;base64,{base64_image}",
+                                    "url": f"data:{content_type};base64,{base64_image}",
                                     "detail": "low"
                                 },
                             },
@@ -71,25 +75,47 @@ def save_text_to_s3(bucket, key, text):
     except Exception as e:
         logger.error(f"Failed to save text to {key} in bucket {bucket}. Error: {e}")
 
+def page_key(event, bucket_name):
+    """
+    Returns the S3 key of the page at event['currentIndex'], or None if it was not uploaded.
+
+    The pages come either as `pngFiles`, a list of S3 URIs, or as `pageManifest`, a
+    compact page manifest whose page URIs are expanded one at a time.
+    """
+    current_index = event['currentIndex']
+    if 'pageManifest' not in event:
+        return event['pngFiles'][current_index].replace(f's3://{bucket_name}/', '')
+
+    manifest = PageManifest.from_json(event['pageManifest'], s3)
+    if manifest.sizes[current_index] is None:
+        return None
+    return manifest.page_uri(current_index + 1).replace(f's3://{bucket_name}/', '')
+
 def lambda_handler(event, context):
     try:
         # Get the S3 bucket name from environment variables
         bucket_name = os.environ['S3_BUCKET_NAME']
         logger.info(f"Processing PNG files from bucket: {bucket_name}")
         
-        # Get current index and PNG files from event
+        # Get current index and PNG file from event
         current_index = event['currentIndex']
-        png_files = event['pngFiles']
+        image_key = page_key(event, bucket_name)
+        if image_key is None:
+            logger.info(f"Skipping page {current_index + 1}, which was not rendered")
+            return {
+                'statusCode': 200,
+                'body': json.dumps({'skipped': True, 'current_index': current_index})
+            }
         
         # Process the current page
-        image_key = png_files[current_index].replace(f's3://{bucket_name}/', '')
         logger.info(f"Processing file: {image_key}")
         
+        image_base, image_extension = os.path.splitext(image_key)
         base64_image = encode_image(bucket_name, image_key)
-        extracted_text = png2txt(base64_image)
+        extracted_text = png2txt(base64_image, content_type=IMAGE_CONTENT_TYPES.get(image_extension, 'image/png'))
         
         # Save the extracted text back to S3
-        text_key = image_key.replace('.png', '.txt')
+        text_key = image_base + '.txt'
         save_text_to_s3(bucket_name, text_key, extracted_text)
         
         logger.info(f"Successfully processed file: {image_key}")
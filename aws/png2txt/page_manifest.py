@@ -0,0 +1,158 @@
+# page_manifest.py
+import base64
+import json
+import struct
+import threading
+from urllib.parse import urlparse
+
+# Page keys are "<prefix>page-<n>.png", with n starting at 1; other page encodings change the extension
+PAGE_TEMPLATE = 'page-{n}.png'
+
+# Per-page data larger than this is written to S3 instead of the DynamoDB item
+MANIFEST_INLINE_MAX_BYTES = 32 * 1024
+
+
+def page_prefix(key):
+    return f"{key.rstrip('.pdf')}/"
+
+
+class PageManifest:
+    """
+    Compact description of the pages rendered from one PDF.
+
+    Instead of one S3 URI per page, the manifest keeps the common prefix, the page
+    naming template and the page count, plus a bitmap of the pages that were
+    uploaded and their sizes packed as 4-byte integers. Page URIs are expanded on
+    demand with `page_uri`/`uploaded_pages`. In DynamoDB it is stored as a map; when
+    the per-page data exceeds MANIFEST_INLINE_MAX_BYTES it is written to
+    `<prefix>manifest.json` and the item only keeps the prefix, template, page
+    count and the manifest's S3 URI, which readers fetch the first time they need it.
+    """
+
+    def __init__(self, prefix, page_count, template=PAGE_TEMPLATE, sizes=None, manifest_uri=None, s3_client=None):
+        self.prefix = prefix
+        self.page_count = page_count
+        self.template = template
+        self.manifest_uri = manifest_uri
+        self._sizes = sizes
+        self._s3 = s3_client
+        self._lock = threading.Lock()
+
+    @classmethod
+    def for_pdf(cls, bucket, key, page_count, template=PAGE_TEMPLATE):
+        """Creates an empty manifest for the pages about to be rendered from s3://bucket/key."""
+        return cls(f"s3://{bucket}/{page_prefix(key)}", page_count, template, sizes=[None] * page_count)
+
+    def page_uri(self, page_number):
+        return self.prefix + self.template.format(n=page_number)
+
+    @property
+    def sizes(self):
+        """Per-page sizes in bytes, None for pages that were not uploaded. Loaded from S3 if spilled."""
+        if self._sizes is None:
+            with self._lock:
+                if self._sizes is None:
+                    self._sizes = self._load()
+        return self._sizes
+
+    def page_done(self, page_number, size):
+        """Records one page's upload; size is None if the page failed."""
+        with self._lock:
+            self._sizes[page_number - 1] = size
+
+    def uploaded_pages(self):
+        """Yields the S3 URIs of the uploaded pages in page order."""
+        for i, size in enumerate(self.sizes):
+            if size is not None:
+                yield self.page_uri(i + 1)
+
+    def _encode(self):
+        bitmap = bytearray((self.page_count + 7) // 8)
+        for i, size in enumerate(self._sizes):
+            if size is not None:
+                bitmap[i // 8] |= 1 << (i % 8)
+        packed_sizes = struct.pack(f'>{self.page_count}I', *(size or 0 for size in self._sizes))
+        return bytes(bitmap), packed_sizes
+
+    def _load(self):
+        parsed = urlparse(self.manifest_uri)
+        response = self._s3.get_object(Bucket=parsed.netloc, Key=parsed.path.lstrip('/'))
+        document = json.loads(response['Body'].read())
+        return self._decode(base64.b64decode(document['uploaded']), base64.b64decode(document['sizes']))
+
+    def _decode(self, bitmap, packed_sizes):
+        sizes = struct.unpack(f'>{self.page_count}I', packed_sizes)
+        return [size if bitmap[i // 8] & (1 << (i % 8)) else None for i, size in enumerate(sizes)]
+
+    def _document(self):
+        bitmap, packed_sizes = self._encode()
+        return {
+            'prefix': self.prefix,
+            'template': self.template,
+            'page_count': self.page_count,
+            'uploaded': base64.b64encode(bitmap).decode('ascii'),
+            'sizes': base64.b64encode(packed_sizes).decode('ascii')
+        }
+
+    def to_dynamodb(self, s3_client=None):
+        """Returns the manifest as a DynamoDB map, spilling per-page data to S3 when it is large."""
+        bitmap, packed_sizes = self._encode()
+        attribute = {
+            'prefix': {'S': self.prefix},
+            'template': {'S': self.template},
+            'page_count': {'N': str(self.page_count)}
+        }
+        if len(bitmap) + len(packed_sizes) <= MANIFEST_INLINE_MAX_BYTES:
+            attribute['uploaded'] = {'B': bitmap}
+            attribute['sizes'] = {'B': packed_sizes}
+            return {'M': attribute}
+
+        self.manifest_uri = self.prefix + 'manifest.json'
+        parsed = urlparse(self.manifest_uri)
+        s3_client.put_object(
+            Bucket=parsed.netloc,
+            Key=parsed.path.lstrip('/'),
+            Body=json.dumps(self._document()),
+            ContentType='application/json'
+        )
+        attribute['manifest_uri'] = {'S': self.manifest_uri}
+        return {'M': attribute}
+
+    @classmethod
+    def from_dynamodb(cls, attribute, s3_client=None):
+        """Reads a manifest map. Spilled per-page data is only fetched (with s3_client) when first used."""
+        fields = attribute['M']
+        manifest = cls(
+            fields['prefix']['S'],
+            int(fields['page_count']['N']),
+            fields['template']['S'],
+            manifest_uri=fields.get('manifest_uri', {}).get('S'),
+            s3_client=s3_client
+        )
+        if 'uploaded' in fields:
+            manifest._sizes = manifest._decode(bytes(fields['uploaded']['B']), bytes(fields['sizes']['B']))
+        return manifest
+
+    def to_json(self):
+        """Returns the manifest as a JSON-serializable dict, e.g. for a Step Functions input."""
+        if self.manifest_uri:
+            return {
+                'prefix': self.prefix,
+                'template': self.template,
+                'page_count': self.page_count,
+                'manifest_uri': self.manifest_uri
+            }
+        return self._document()
+
+    @classmethod
+    def from_json(cls, document, s3_client=None):
+        manifest = cls(
+            document['prefix'],
+            int(document['page_count']),
+            document.get('template', PAGE_TEMPLATE),
+            manifest_uri=document.get('manifest_uri'),
+            s3_client=s3_client
+        )
+        if 'uploaded' in document:
+            manifest._sizes = manifest._decode(base64.b64decode(document['uploaded']), base64.b64decode(document['sizes']))
+        return manifest
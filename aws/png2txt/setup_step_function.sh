@@ -53,6 +53,25 @@ EOF
     echo "IAM role $ROLE_NAME created and policies attached."
 fi
 
+# Let the state machine mark documents Done in the metadata table once their text is extracted, or Failed
+cat << EOF > dynamodb-policy.json
+{
+  "Version": "2012-10-17",
+  "Statement": [
+    {
+      "Effect": "Allow",
+      "Action": "dynamodb:UpdateItem",
+      "Resource": "arn:aws:dynamodb:$REGION:*:table/$DYNAMODB_TABLE"
+    }
+  ]
+}
+EOF
+
+aws iam put-role-policy --role-name $ROLE_NAME \
+    --region $REGION --profile $PROFILE \
+    --policy-name DocumentStateUpdate \
+    --policy-document file://dynamodb-policy.json
+
 # Get the ARN of the IAM role
 ROLE_ARN=$(aws iam get-role --role-name $ROLE_NAME \
   --region $REGION --profile $PROFILE \
@@ -64,8 +83,206 @@ ROLE_ARN=$(aws iam get-role --role-name $ROLE_NAME \
 cat << EOF > state-machine-definition.json
 {
   "Comment": "A step function to process PNG files to TXT using a Lambda function",
-  "StartAt": "Initialize",
+  "StartAt": "CheckInput",
   "States": {
+    "CheckInput": {
+      "Type": "Choice",
+      "Choices": [
+        {
+          "Variable": "$.pageManifest",
+          "IsPresent": true,
+          "Next": "InitializeFromManifest"
+        }
+      ],
+      "Default": "Initialize"
+    },
+    "InitializeFromManifest": {
+      "Type": "Pass",
+      "Parameters": {
+        "currentIndex": 0,
+        "pageManifest.$": "$.pageManifest"
+      },
+      "ResultPath": "$.processingInfo",
+      "Next": "CountManifestPages"
+    },
+    "CountManifestPages": {
+      "Type": "Pass",
+      "Parameters": {
+        "fileCount.$": "$.pageManifest.page_count"
+      },
+      "ResultPath": "$.fileCount",
+      "Next": "CheckManifestPageLimit"
+    },
+    "CheckManifestPageLimit": {
+      "Type": "Choice",
+      "Choices": [
+        {
+          "Variable": "$.fileCount.fileCount",
+          "NumericEquals": 0,
+          "Next": "CheckDocument"
+        },
+        {
+          "Variable": "$.fileCount.fileCount",
+          "NumericGreaterThan": 3200,
+          "Next": "LimitManifestPages"
+        }
+      ],
+      "Default": "ProcessManifestPage"
+    },
+    "LimitManifestPages": {
+      "Type": "Pass",
+      "Result": {
+        "fileCount": 3200
+      },
+      "ResultPath": "$.fileCount",
+      "Next": "ProcessManifestPage"
+    },
+    "ProcessManifestPage": {
+      "Type": "Task",
+      "Resource": "$LAMBDA_FUNCTION_ARN",
+      "Parameters": {
+        "currentIndex.$": "$.processingInfo.currentIndex",
+        "pageManifest.$": "$.processingInfo.pageManifest"
+      },
+      "ResultPath": "$.lambdaResult",
+      "Retry": [
+        {
+          "ErrorEquals": [
+            "Lambda.ServiceException",
+            "Lambda.AWSLambdaException",
+            "Lambda.SdkClientException",
+            "Lambda.TooManyRequestsException"
+          ],
+          "IntervalSeconds": 2,
+          "MaxAttempts": 6,
+          "BackoffRate": 2
+        },
+        {
+          "ErrorEquals": ["States.ALL"],
+          "IntervalSeconds": 5,
+          "MaxAttempts": 2,
+          "BackoffRate": 2
+        }
+      ],
+      "Catch": [
+        {
+          "ErrorEquals": ["States.ALL"],
+          "ResultPath": "$.error",
+          "Next": "CheckFailedDocument"
+        }
+      ],
+      "Next": "IncrementManifestIndex"
+    },
+    "IncrementManifestIndex": {
+      "Type": "Pass",
+      "Parameters": {
+        "currentIndex.$": "States.MathAdd($.processingInfo.currentIndex, 1)",
+        "pageManifest.$": "$.processingInfo.pageManifest"
+      },
+      "ResultPath": "$.processingInfo",
+      "Next": "CheckForMoreManifestPages"
+    },
+    "CheckForMoreManifestPages": {
+      "Type": "Choice",
+      "Choices": [
+        {
+          "Variable": "$.processingInfo.currentIndex",
+          "NumericLessThanPath": "$.fileCount.fileCount",
+          "Next": "ProcessManifestPage"
+        }
+      ],
+      "Default": "CheckDocument"
+    },
+    "CheckDocument": {
+      "Type": "Choice",
+      "Choices": [
+        {
+          "Variable": "$.documentUrl",
+          "IsPresent": true,
+          "Next": "MarkDocumentDone"
+        }
+      ],
+      "Default": "Done"
+    },
+    "MarkDocumentDone": {
+      "Type": "Task",
+      "Resource": "arn:aws:states:::dynamodb:updateItem",
+      "Parameters": {
+        "TableName": "$DYNAMODB_TABLE",
+        "Key": {
+          "url": {"S.$": "$.documentUrl"}
+        },
+        "UpdateExpression": "SET #status = :done, #version = #version + :one",
+        "ConditionExpression": "#status = :extracting AND #version = :version",
+        "ExpressionAttributeNames": {
+          "#status": "status",
+          "#version": "version"
+        },
+        "ExpressionAttributeValues": {
+          ":done": {"S": "Done"},
+          ":extracting": {"S": "Extracting"},
+          ":one": {"N": "1"},
+          ":version": {"N.$": "States.Format('{}', $.documentVersion)"}
+        }
+      },
+      "ResultPath": null,
+      "Catch": [
+        {
+          "ErrorEquals": ["DynamoDB.ConditionalCheckFailedException"],
+          "ResultPath": null,
+          "Next": "Done"
+        }
+      ],
+      "Next": "Done"
+    },
+    "CheckFailedDocument": {
+      "Type": "Choice",
+      "Choices": [
+        {
+          "Variable": "$.documentUrl",
+          "IsPresent": true,
+          "Next": "MarkDocumentFailed"
+        }
+      ],
+      "Default": "ExtractionFailed"
+    },
+    "MarkDocumentFailed": {
+      "Type": "Task",
+      "Resource": "arn:aws:states:::dynamodb:updateItem",
+      "Parameters": {
+        "TableName": "$DYNAMODB_TABLE",
+        "Key": {
+          "url": {"S.$": "$.documentUrl"}
+        },
+        "UpdateExpression": "SET #status = :failed, #version = #version + :one, failure_reason = :reason",
+        "ConditionExpression": "#status = :extracting AND #version = :version",
+        "ExpressionAttributeNames": {
+          "#status": "status",
+          "#version": "version"
+        },
+        "ExpressionAttributeValues": {
+          ":failed": {"S": "Failed"},
+          ":extracting": {"S": "Extracting"},
+          ":one": {"N": "1"},
+          ":reason": {"S.$": "States.Format('extraction: {}', $.error.Error)"},
+          ":version": {"N.$": "States.Format('{}', $.documentVersion)"}
+        }
+      },
+      "ResultPath": null,
+      "Catch": [
+        {
+          "ErrorEquals": ["States.ALL"],
+          "ResultPath": null,
+          "Next": "ExtractionFailed"
+        }
+      ],
+      "Next": "ExtractionFailed"
+    },
+    "ExtractionFailed": {
+      "Type": "Fail",
+      "Error": "ExtractionFailed",
+      "Cause": "Text extraction failed for a page"
+    },
     "Initialize": {
       "Type": "Pass",
       "Parameters": {
@@ -112,6 +329,32 @@ cat << EOF > state-machine-definition.json
         "pngFiles.$": "$.processingInfo.pngFiles"
       },
       "ResultPath": "$.lambdaResult",
+      "Retry": [
+        {
+          "ErrorEquals": [
+            "Lambda.ServiceException",
+            "Lambda.AWSLambdaException",
+            "Lambda.SdkClientException",
+            "Lambda.TooManyRequestsException"
+          ],
+          "IntervalSeconds": 2,
+          "MaxAttempts": 6,
+          "BackoffRate": 2
+        },
+        {
+          "ErrorEquals": ["States.ALL"],
+          "IntervalSeconds": 5,
+          "MaxAttempts": 2,
+          "BackoffRate": 2
+        }
+      ],
+      "Catch": [
+        {
+          "ErrorEquals": ["States.ALL"],
+          "ResultPath": "$.error",
+          "Next": "CheckFailedDocument"
+        }
+      ],
       "Next": "CheckForMorePages"
     },
     "CheckForMorePages": {
@@ -14,10 +14,13 @@ ROLE_NAME="LambdaExecutionRole"
 ZIP_FILE="function.zip"
 LAMBDA_HANDLER="lambda_function.lambda_handler"
 RUNTIME="python3.9"
+SUBMISSION_INDEX_TABLE="PdfSubmissionIndexTable"
+METADATA_TABLE="PdfMetadataTable"
+NEGATIVE_CACHE_TABLE="PdfNegativeCacheTable"
 
 # Step 1: Create a zip file for the Lambda function
 echo "Zipping the Lambda function..."
-zip -j $ZIP_FILE lambda_function.py
+zip -j $ZIP_FILE lambda_function.py submission_index.py negative_cache.py
 
 # Step 2: Discover the SQS Queue URL
 echo "Discovering the SQS Queue URL..."
@@ -30,6 +33,26 @@ fi
 
 echo "Queue URL: $QUEUE_URL"
 
+# Step 2b: Create the submission index table (items expire via TTL on expires_at) if not exists
+if aws dynamodb describe-table --table-name $SUBMISSION_INDEX_TABLE --region $REGION --profile $PROFILE >/dev/null 2>&1; then
+  echo "DynamoDB table '$SUBMISSION_INDEX_TABLE' already exists."
+else
+  aws dynamodb create-table \
+    --table-name $SUBMISSION_INDEX_TABLE \
+    --attribute-definitions AttributeName=url,AttributeType=S \
+    --key-schema AttributeName=url,KeyType=HASH \
+    --billing-mode PAY_PER_REQUEST \
+    --region $REGION \
+    --profile $PROFILE
+  aws dynamodb wait table-exists --table-name $SUBMISSION_INDEX_TABLE --region $REGION --profile $PROFILE
+  aws dynamodb update-time-to-live \
+    --table-name $SUBMISSION_INDEX_TABLE \
+    --time-to-live-specification Enabled=true,AttributeName=expires_at \
+    --region $REGION \
+    --profile $PROFILE
+  echo "DynamoDB table '$SUBMISSION_INDEX_TABLE' created."
+fi
+
 # Step 3: Create the IAM Role for Lambda execution if not exists
 echo "Creating IAM Role..."
 ROLE_ARN=$(aws iam get-role --role-name $ROLE_NAME --region $REGION --profile $PROFILE --query 'Role.Arn' --output text 2>/dev/null || true)
@@ -78,6 +101,28 @@ fi
 
 echo "Role ARN: $ROLE_ARN"
 
+# Allow the function to claim URLs in the submission index and read their status
+ACCOUNT_ID=$(aws sts get-caller-identity --query Account --output text --region $REGION --profile $PROFILE)
+aws iam put-role-policy \
+  --role-name $ROLE_NAME \
+  --policy-name SubmissionIndexAccess \
+  --policy-document '{
+    "Version": "2012-10-17",
+    "Statement": [
+      {
+        "Effect": "Allow",
+        "Action": ["dynamodb:PutItem", "dynamodb:GetItem", "dynamodb:DeleteItem"],
+        "Resource": [
+          "arn:aws:dynamodb:'"$REGION"':'"$ACCOUNT_ID"':table/'"$SUBMISSION_INDEX_TABLE"'",
+          "arn:aws:dynamodb:'"$REGION"':'"$ACCOUNT_ID"':table/'"$METADATA_TABLE"'",
+          "arn:aws:dynamodb:'"$REGION"':'"$ACCOUNT_ID"':table/'"$NEGATIVE_CACHE_TABLE"'"
+        ]
+      }
+    ]
+  }' \
+  --region $REGION \
+  --profile $PROFILE
+
 # Step 4: Create or update the Lambda function
 echo "Deploying the Lambda function..."
 LAMBDA_ARN=$(aws lambda get-function --function-name $FUNCTION_NAME --region $REGION --profile $PROFILE --query 'Configuration.FunctionArn' --output text 2>/dev/null || true)
@@ -89,7 +134,7 @@ if [ -z "$LAMBDA_ARN" ]; then
     --handler $LAMBDA_HANDLER \
     --runtime $RUNTIME \
     --role $ROLE_ARN \
-    --environment Variables={SQS_QUEUE_URL=$QUEUE_URL} \
+    --environment Variables={SQS_QUEUE_URL=$QUEUE_URL,SUBMISSION_INDEX_TABLE=$SUBMISSION_INDEX_TABLE,DYNAMODB_TABLE=$METADATA_TABLE,NEGATIVE_CACHE_TABLE=$NEGATIVE_CACHE_TABLE} \
     --region $REGION \
     --profile $PROFILE
 else
@@ -101,7 +146,7 @@ else
 
   aws lambda update-function-configuration \
     --function-name $FUNCTION_NAME \
-    --environment Variables={SQS_QUEUE_URL=$QUEUE_URL} \
+    --environment Variables={SQS_QUEUE_URL=$QUEUE_URL,SUBMISSION_INDEX_TABLE=$SUBMISSION_INDEX_TABLE,DYNAMODB_TABLE=$METADATA_TABLE,NEGATIVE_CACHE_TABLE=$NEGATIVE_CACHE_TABLE} \
     --region $REGION \
     --profile $PROFILE
 fi
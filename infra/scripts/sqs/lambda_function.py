@@ -2,25 +2,190 @@ import json
 import boto3
 import os
 import logging
+import re
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse, urlunparse
+from submission_index import BloomFilter, SubmissionIndex
+from negative_cache import NegativeCache
 
 # Set up logging
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+# Most URLs accepted in one bulk request, and SendMessageBatch calls made in parallel
+MAX_URLS_PER_REQUEST = int(os.getenv('MAX_URLS_PER_REQUEST', 10000))
+SEND_CONCURRENCY = int(os.getenv('SEND_CONCURRENCY', 8))
+
 sqs = boto3.client('sqs')
+dynamodb = boto3.client('dynamodb')
+
+# Optional index of recently queued URLs (DynamoDB table with a TTL on expires_at) that keeps
+# duplicates off the queue; BLOOM_FILTER_CAPACITY > 0 adds an in-memory filter for hot duplicates.
+# A URL whose document Failed, has none SUBMISSION_PENDING_SECONDS after queueing, or has been stuck
+# in progress for DOCUMENT_STALE_SECONDS (as in the consumers' stale takeover) can be queued again
+SUBMISSION_INDEX_TABLE = os.getenv('SUBMISSION_INDEX_TABLE')
+SUBMISSION_TTL_SECONDS = int(os.getenv('SUBMISSION_TTL_SECONDS', 7 * 24 * 3600))
+SUBMISSION_PENDING_SECONDS = int(os.getenv('SUBMISSION_PENDING_SECONDS', 3600))
+DOCUMENT_STALE_SECONDS = int(os.getenv('DOCUMENT_STALE_SECONDS', 3600))
+BLOOM_FILTER_CAPACITY = int(os.getenv('BLOOM_FILTER_CAPACITY', 0))
+BLOOM_FILTER_ERROR_RATE = float(os.getenv('BLOOM_FILTER_ERROR_RATE', 0.001))
+submission_index = SubmissionIndex(
+    dynamodb, SUBMISSION_INDEX_TABLE, SUBMISSION_TTL_SECONDS,
+    metadata_table=os.getenv('DYNAMODB_TABLE'),
+    bloom_filter=BloomFilter(BLOOM_FILTER_CAPACITY, BLOOM_FILTER_ERROR_RATE) if BLOOM_FILTER_CAPACITY > 0 else None,
+    pending_seconds=SUBMISSION_PENDING_SECONDS,
+    stale_seconds=DOCUMENT_STALE_SECONDS
+) if SUBMISSION_INDEX_TABLE else None
+
+# Optional cache of URLs whose fetch failed permanently (shared with the consumers); these are rejected
+NEGATIVE_CACHE_TABLE = os.getenv('NEGATIVE_CACHE_TABLE')
+negative_cache = NegativeCache(
+    dynamodb, NEGATIVE_CACHE_TABLE,
+    int(os.getenv('NEGATIVE_CACHE_TTL_SECONDS', 7 * 24 * 3600)),
+    int(os.getenv('NEGATIVE_CACHE_LOCAL_SIZE', 10000))
+) if NEGATIVE_CACHE_TABLE else None
+
+def clean_url(pdf_url):
+    # Same normalization as pdf_downloader.clean_url, so queued URLs match what the consumers store
+    parsed_url = urlparse(pdf_url)
+    cleaned_url = urlunparse(parsed_url._replace(query='', fragment=''))
+    return cleaned_url
+
+def is_pdf_url(cleaned_url):
+    return re.match(r'^https?://.*\.pdf$', cleaned_url, re.IGNORECASE) is not None
+
+def parse_body(raw_body):
+    """Parses a JSON request body, falling back to JSONL (one JSON value per line) for bulk submissions."""
+    try:
+        return json.loads(raw_body)
+    except json.JSONDecodeError:
+        lines = [line for line in raw_body.splitlines() if line.strip()]
+        if len(lines) < 2:
+            raise
+        return [json.loads(line) for line in lines]
+
+def extract_urls(body):
+    """
+    Extracts the submitted URLs from a bulk request body: a list, or an object with
+    a 'urls' list, whose entries are URL strings or objects with a 'url' or 'message' field.
+    """
+    entries = body['urls'] if isinstance(body, dict) else body
+    if not isinstance(entries, list):
+        raise ValueError('Expected a list of URLs')
+
+    urls = []
+    for entry in entries:
+        if isinstance(entry, dict):
+            entry = entry.get('url', entry.get('message'))
+        if not isinstance(entry, str):
+            raise ValueError(f'Invalid URL entry: {json.dumps(entry)}')
+        urls.append(entry)
+    return urls
+
+def send_batch(queue_url, entries):
+    """Sends up to 10 (index, cleaned_url) entries and returns their per-URL outcomes."""
+    results = {}
+    try:
+        response = sqs.send_message_batch(
+            QueueUrl=queue_url,
+            Entries=[{'Id': str(index), 'MessageBody': cleaned_url} for index, cleaned_url in entries]
+        )
+    except Exception as e:
+        logger.error("Failed to send message batch: %s", str(e))
+        return {index: {'status': 'failed', 'error': str(e)} for index, _ in entries}
+
+    for success in response.get('Successful', []):
+        results[int(success['Id'])] = {'status': 'queued', 'messageId': success['MessageId']}
+    for failure in response.get('Failed', []):
+        results[int(failure['Id'])] = {'status': 'failed', 'error': failure.get('Message', failure['Code'])}
+    return results
+
+def known_failure(cleaned_url):
+    """Returns the failure class if the URL is known to fail permanently, otherwise None."""
+    try:
+        return negative_cache.lookup(cleaned_url)
+    except Exception as e:
+        logger.error("Failed to check negative cache for %s: %s", cleaned_url, str(e))
+        return None
+
+def claim_submission(cleaned_url):
+    """Returns None if the URL should be queued, otherwise the status of the already known URL."""
+    try:
+        return submission_index.claim(cleaned_url)
+    except Exception as e:
+        # Queue the URL anyway; the consumers tolerate duplicates
+        logger.error("Failed to check submission index for %s: %s", cleaned_url, str(e))
+        return None
+
+def enqueue_urls(queue_url, urls):
+    """
+    Validates and normalizes each URL and queues the valid ones 10 per SendMessageBatch call,
+    rejecting URLs known to fail and skipping URLs the submission index already knows.
+    """
+    results = []
+    entries = []
+    for index, url in enumerate(urls):
+        cleaned_url = clean_url(url.strip())
+        result = {'url': url, 'cleanedUrl': cleaned_url}
+        if not is_pdf_url(cleaned_url):
+            result.update({'status': 'invalid', 'error': 'Not a PDF URL'})
+        else:
+            entries.append((index, cleaned_url))
+        results.append(result)
+
+    with ThreadPoolExecutor(max_workers=SEND_CONCURRENCY) as executor:
+        if negative_cache:
+            failures = executor.map(lambda entry: known_failure(entry[1]), entries)
+            new_entries = []
+            for (index, cleaned_url), failure_class in zip(entries, failures):
+                if failure_class is None:
+                    new_entries.append((index, cleaned_url))
+                else:
+                    results[index].update({'status': 'rejected', 'error': f'URL failed permanently ({failure_class})'})
+            entries = new_entries
+
+        if submission_index:
+            claims = executor.map(lambda entry: claim_submission(entry[1]), entries)
+            new_entries = []
+            for (index, cleaned_url), existing_status in zip(entries, claims):
+                if existing_status is None:
+                    new_entries.append((index, cleaned_url))
+                else:
+                    results[index].update({'status': 'duplicate', 'existingStatus': existing_status})
+            entries = new_entries
+
+        batches = [entries[start:start + 10] for start in range(0, len(entries), 10)]
+        for outcomes in executor.map(lambda batch: send_batch(queue_url, batch), batches):
+            for index, outcome in outcomes.items():
+                results[index].update(outcome)
+                cleaned_url = results[index]['cleanedUrl']
+                if submission_index and outcome['status'] == 'queued':
+                    submission_index.remember(cleaned_url)
+                elif submission_index:
+                    submission_index.release(cleaned_url)
+
+    logger.info("Bulk submission: %d URLs, %d queued", len(urls),
+                sum(1 for result in results if result['status'] == 'queued'))
+    return results
 
 def lambda_handler(event, context):
     logger.info("Event received: %s", json.dumps(event))
 
-    # Extract the message from the event
+    # Extract the message, or the list of URLs for a bulk submission, from the event
+    message = None
+    urls = None
     try:
         if 'body' not in event:
             raise KeyError('body')
-        body = json.loads(event['body'])
-        if 'message' not in body:
-            raise KeyError('message')
-        message = body['message']
-        logger.info("Extracted message: %s", message)
+        body = parse_body(event['body'])
+        if isinstance(body, dict) and 'urls' not in body:
+            if 'message' not in body:
+                raise KeyError('message')
+            message = body['message']
+            logger.info("Extracted message: %s", message)
+        else:
+            urls = extract_urls(body)
+            logger.info("Extracted %d URLs", len(urls))
     except KeyError as e:
         logger.error("Missing key: %s", str(e))
         return {
@@ -33,7 +198,19 @@ def lambda_handler(event, context):
             'statusCode': 400,
             'body': json.dumps({'error': 'Invalid request', 'message': 'JSON decode error'})
         }
-    
+    except ValueError as e:
+        logger.error("Invalid URL list: %s", str(e))
+        return {
+            'statusCode': 400,
+            'body': json.dumps({'error': 'Invalid request', 'message': str(e)})
+        }
+
+    if urls is not None and len(urls) > MAX_URLS_PER_REQUEST:
+        return {
+            'statusCode': 413,
+            'body': json.dumps({'error': 'Invalid request', 'message': f'At most {MAX_URLS_PER_REQUEST} URLs per request'})
+        }
+
     # Get the SQS queue URL from the environment variables
     queue_url = os.environ.get('SQS_QUEUE_URL')
     if not queue_url:
@@ -43,7 +220,36 @@ def lambda_handler(event, context):
             'body': json.dumps({'error': 'Internal server error', 'message': 'SQS queue URL not set'})
         }
     logger.info("Queue URL: %s", queue_url)
-    
+
+    # Queue bulk submissions in batches and report the outcome of each URL
+    if urls is not None:
+        return {
+            'statusCode': 200,
+            'body': json.dumps({'results': enqueue_urls(queue_url, urls)})
+        }
+
+    # Reject URLs that are known to fail instead of queueing them again
+    if negative_cache and isinstance(message, str) and is_pdf_url(clean_url(message.strip())):
+        failure_class = known_failure(clean_url(message.strip()))
+        if failure_class is not None:
+            logger.info("Rejecting URL that failed permanently: %s (%s)", message, failure_class)
+            return {
+                'statusCode': 422,
+                'body': json.dumps({'error': 'Invalid request', 'message': f'URL failed permanently ({failure_class})'})
+            }
+
+    # Answer URLs that were already queued with their current status instead of queueing them again
+    cleaned_url = None
+    if submission_index and isinstance(message, str) and is_pdf_url(clean_url(message.strip())):
+        cleaned_url = clean_url(message.strip())
+        existing_status = claim_submission(cleaned_url)
+        if existing_status is not None:
+            logger.info("URL already submitted: %s (%s)", cleaned_url, existing_status)
+            return {
+                'statusCode': 200,
+                'body': json.dumps({'duplicate': True, 'status': existing_status})
+            }
+
     # Send the message to SQS
     try:
         response = sqs.send_message(
@@ -51,12 +257,16 @@ def lambda_handler(event, context):
             MessageBody=message
         )
         logger.info("Message sent to SQS: %s", response['MessageId'])
+        if cleaned_url:
+            submission_index.remember(cleaned_url)
         return {
             'statusCode': 200,
             'body': json.dumps({'messageId': response['MessageId']})
         }
     except Exception as e:
         logger.error("Failed to send message: %s", str(e))
+        if cleaned_url:
+            submission_index.release(cleaned_url)
         return {
             'statusCode': 500,
             'body': json.dumps({'error': 'Failed to send message', 'message': str(e)})
@@ -0,0 +1,179 @@
+import hashlib
+import logging
+import math
+import time
+from datetime import datetime
+from botocore.exceptions import ClientError
+
+# Set up logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Statuses of the document state machine in the metadata table (see document_state.py)
+QUEUED = 'Queued'
+FAILED = 'Failed'
+IN_PROGRESS = ('Downloading', 'Rendering', 'Extracting')
+
+class BloomFilter:
+    """Fixed-size Bloom filter over strings: no false negatives, about `error_rate` false positives."""
+
+    def __init__(self, capacity, error_rate=0.001):
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item):
+        digest = hashlib.blake2b(item.encode('utf-8'), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], 'big'), int.from_bytes(digest[8:], 'big')
+        return [(first + i * second) % self.size for i in range(self.hash_count)]
+
+    def add(self, item):
+        for position in self._positions(item):
+            self.bits[position // 8] |= 1 << (position % 8)
+
+    def __contains__(self, item):
+        return all(self.bits[position // 8] & (1 << (position % 8)) for position in self._positions(item))
+
+class SubmissionIndex:
+    """
+    DynamoDB index of the cleaned URLs that have been queued recently.
+
+    The table is keyed on `url` (S) and its items expire through a DynamoDB TTL on
+    `expires_at`, after which the URL can be queued again (and is then re-fetched
+    conditionally by the consumers). A claim is a conditional put, so concurrent
+    submissions of the same URL queue it once. URLs that are already known are
+    answered with their status from the metadata table when it has one. A URL whose
+    document Failed, that still has no document `pending_seconds` after it was
+    queued (its message went to the dead-letter queue), or whose document has sat in
+    an in-progress state for `stale_seconds` (its worker is gone, see the stale
+    takeover in document_state.py) may be submitted again.
+
+    The optional Bloom filter remembers URLs this container has seen queued. A hit is
+    only a hint: it is answered by reading the URL's status instead of attempting the
+    claim, and a URL without a status, a resubmittable one, or a false positive, goes
+    on to claim as usual.
+    """
+
+    def __init__(self, dynamodb_client, table_name, ttl_seconds, metadata_table=None, bloom_filter=None,
+                 pending_seconds=3600, stale_seconds=3600):
+        self.dynamodb = dynamodb_client
+        self.table_name = table_name
+        self.ttl_seconds = ttl_seconds
+        self.metadata_table = metadata_table
+        self.bloom_filter = bloom_filter
+        self.pending_seconds = pending_seconds
+        self.stale_seconds = stale_seconds
+
+    def claim(self, cleaned_url):
+        """
+        Records cleaned_url as queued.
+
+        Returns:
+        - None if the claim succeeded and the URL should be queued, otherwise the status of the known URL.
+        """
+        now = int(time.time())
+        if self.bloom_filter is not None and cleaned_url in self.bloom_filter:
+            document = self._document(cleaned_url)
+            status = document.get('status', {}).get('S')
+            # The claim's age is checked once the claim is attempted
+            if status is not None and status != FAILED and not self._stale(document, 0, now):
+                return status
+
+        existing = self._put_claim(
+            cleaned_url, now,
+            # TTL deletion lags expiry, so treat expired items as absent
+            'attribute_not_exists(#url) OR expires_at < :now',
+            {':now': {'N': str(now)}}
+        )
+        if existing is None:
+            return None
+
+        document = self._document(cleaned_url)
+        status = document.get('status', {}).get('S')
+        if not self._resubmittable(document, existing, now):
+            self.remember(cleaned_url)
+            return status or QUEUED
+
+        # Replace the claim, unless a concurrent submission of the URL already did
+        logger.info("Resubmitting %s (status %s)", cleaned_url, status)
+        replace = 'attribute_exists(#url) AND expires_at = :expires_at'
+        if self._put_claim(cleaned_url, now, replace, {':expires_at': existing['expires_at']}) is None:
+            return None
+        return self.status(cleaned_url) or QUEUED
+
+    def _put_claim(self, cleaned_url, now, condition, values):
+        """Writes the claim if `condition` holds. Returns None on success, otherwise the existing claim."""
+        try:
+            self.dynamodb.put_item(
+                TableName=self.table_name,
+                Item={
+                    'url': {'S': cleaned_url},
+                    'status': {'S': QUEUED},
+                    'submitted_timestamp': {'S': datetime.utcnow().isoformat()},
+                    'expires_at': {'N': str(now + self.ttl_seconds)}
+                },
+                ConditionExpression=condition,
+                ExpressionAttributeNames={'#url': 'url'},
+                ExpressionAttributeValues=values,
+                ReturnValuesOnConditionCheckFailure='ALL_OLD'
+            )
+            return None
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+            return e.response['Item']
+
+    def _resubmittable(self, document, existing, now):
+        """
+        True if a claimed URL may be queued again: its document failed since the claim was
+        made, is stuck in an in-progress state, or has not appeared pending_seconds after it.
+        """
+        if not self.metadata_table:
+            return False
+        submitted_at = int(existing['expires_at']['N']) - self.ttl_seconds
+        status = document.get('status', {}).get('S')
+        if self._stale(document, submitted_at, now):
+            return True
+        if status == FAILED:
+            # A failure from before the claim is already being retried by the claim's message
+            return int(document.get('status_updated_at', {}).get('N', now)) > submitted_at
+        return status is None and now - submitted_at >= self.pending_seconds
+
+    def _stale(self, document, submitted_at, now):
+        """
+        True if the document has been in an in-progress state for stale_seconds, counted from
+        the later of its last transition and the claim, so a resubmission gets time to take over.
+        """
+        if document.get('status', {}).get('S') not in IN_PROGRESS:
+            return False
+        updated_at = int(document.get('status_updated_at', {}).get('N', now))
+        return now - max(updated_at, submitted_at) > self.stale_seconds
+
+    def _document(self, cleaned_url):
+        """Returns the status attributes of a URL's item in the metadata table, or an empty dict."""
+        if not self.metadata_table:
+            return {}
+        response = self.dynamodb.get_item(
+            TableName=self.metadata_table,
+            Key={'url': {'S': cleaned_url}},
+            ProjectionExpression='#status, status_updated_at',
+            ExpressionAttributeNames={'#status': 'status'},
+            ConsistentRead=True
+        )
+        return response.get('Item', {})
+
+    def status(self, cleaned_url):
+        """Returns the processing status recorded for a known URL in the metadata table, or None if it has none."""
+        return self._document(cleaned_url).get('status', {}).get('S')
+
+    def remember(self, cleaned_url):
+        """Adds a queued URL to the Bloom filter, if there is one."""
+        if self.bloom_filter is not None:
+            self.bloom_filter.add(cleaned_url)
+
+    def release(self, cleaned_url):
+        """Removes a claim whose message could not be queued, so the URL can be submitted again."""
+        try:
+            self.dynamodb.delete_item(TableName=self.table_name, Key={'url': {'S': cleaned_url}})
+        except Exception as e:
+            logger.error("Failed to release submission of %s: %s", cleaned_url, str(e))
@@ -5,6 +5,9 @@ $(document).ready(function() {
     let userToken = null;
     let currentPage = 1;
     const pdfPrefix = 'docs_aws_amazon_com/web-application-hosting-best-practices/web-application-hosting-best-practices/';
+    // Page images are stored as PNG, JPEG or WebP depending on the render profile (see render_profile.py)
+    const pageImageExtensions = ['png', 'jpg', 'webp'];
+    let pageImageExtension = null;
 
     // Google login event
     $("#google-login").click(function() {
@@ -117,24 +120,38 @@ $(document).ready(function() {
         loadPage();
     }
 
-    function loadPage() {
-        const pageImageUrl = `${pdfPrefix}page-${currentPage}.png`;
-        const pageTextUrl = `${pdfPrefix}page-${currentPage}.txt`;
-
-        const s3 = new AWS.S3();
+    // Loads the page image, trying each extension until one exists and remembering it for later pages
+    function loadPageImage(s3, extensions) {
+        const extension = extensions[0];
+        const pageImageUrl = `${pdfPrefix}page-${currentPage}.${extension}`;
 
         s3.getObject({ Bucket: awsConfig.Bucket, Key: pageImageUrl }, function(err, data) {
-            if (err) {
+            // Without s3:ListBucket a missing key is reported as AccessDenied
+            if (err && (err.code === 'NoSuchKey' || err.code === 'AccessDenied') && extensions.length > 1) {
+                loadPageImage(s3, extensions.slice(1));
+            } else if (err) {
                 console.error('Error loading page image:', err);
                 if (err.code === 'CredentialsError') {
                     console.error('AWS credentials are missing. Please log in and try again.');
                 }
                 $("#page-image").attr("src", "");
             } else {
+                pageImageExtension = extension;
                 const url = URL.createObjectURL(new Blob([data.Body], { type: data.ContentType }));
                 $("#page-image").attr("src", url);
             }
         });
+    }
+
+    function loadPage() {
+        const pageTextUrl = `${pdfPrefix}page-${currentPage}.txt`;
+
+        const s3 = new AWS.S3();
+
+        // Try the extension that worked last first
+        loadPageImage(s3, pageImageExtension
+            ? [pageImageExtension, ...pageImageExtensions.filter((extension) => extension !== pageImageExtension)]
+            : pageImageExtensions);
 
         s3.getObject({ Bucket: awsConfig.Bucket, Key: pageTextUrl }, function(err, data) {
             if (err) {